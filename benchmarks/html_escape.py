@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+""" HTML escaping benchmark.
+
+Compares swinf.utils.html.html_escape with the str() and five
+replace() escaper it replaced, per value and in the render of a
+large table.
+
+Usage:
+    PYTHONPATH=. python benchmarks/html_escape.py
+    PYTHONPATH=. python benchmarks/html_escape.py -r 1000
+
+Escapers:
+    replace     the old escaper, as a baseline
+    escape      html_escape
+
+Cases:
+    int, float      numbers, not scanned by html_escape
+    clean           short unicode strings without special characters
+    special         short unicode strings with special characters
+    long            a unicode string of 2000 characters
+    markup          Markup fragments, passed on by html_escape
+    table           SimpleTemplate.render of ROWS rows of all of the above
+
+Reported are ns per value, ms per render for the table.
+"""
+import sys
+import timeit
+from optparse import OptionParser
+
+from swinf.utils.html import Markup, html_escape
+from swinf.template import SimpleTemplate
+
+ROWS = 10000
+CASES = ('int', 'float', 'clean', 'special', 'long', 'markup', 'table')
+
+
+def escape_replace(c):
+    """ html_escape before the single scan, for ascii values only. """
+    c = str(c)
+    return c.replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')\
+                 .replace('"','&quot;').replace("'",'&#039;')
+
+
+ESCAPERS = (('replace', escape_replace), ('escape', html_escape))
+
+TABLE = u'''<table>
+%% for row in rows:
+<tr><td>{{row[0]}}</td><td>{{row[1]}}</td><td>{{row[2]}}</td><td>{{row[3]}}</td><td>{{row[4]}}</td></tr>
+%% end
+</table>
+'''
+
+
+def make_values(rows=ROWS):
+    return {
+        'int': range(rows),
+        'float': [i * 1.5 for i in xrange(rows)],
+        'clean': [u'user %d' % i for i in xrange(rows)],
+        'special': [u'<user %d & co>' % i for i in xrange(rows)],
+        'long': [u'lorem ipsum ' * 166] * (rows // 100 or 1),
+        'markup': [Markup(u'<b>%d</b>' % i) for i in xrange(rows)],
+    }
+
+
+def best(func, min_time=0.2, repeat=5):
+    """ Returns the best seconds of a call of `func`. """
+    timer = timeit.default_timer
+    loops = 1
+    while True:
+        start = timer()
+        for _ in xrange(loops):
+            func()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    result = elapsed / loops
+    for _ in xrange(repeat - 1):
+        start = timer()
+        for _ in xrange(loops):
+            func()
+        result = min(result, (timer() - start) / loops)
+    return result
+
+
+def run(cases=CASES, rows=ROWS, min_time=0.2, out=sys.stdout):
+    values = make_values(rows)
+    table = zip(values['int'], values['float'], values['clean'], \
+            values['special'], values['markup'])
+    out.write('%-8s %-8s %12s\n' % ('case', 'escaper', 'time'))
+    results = []
+    for case in cases:
+        for name, escape in ESCAPERS:
+            if case == 'table':
+                tpl = SimpleTemplate(TABLE, escape_func=escape)
+                seconds = best(lambda: tpl.render(rows=table), min_time)
+                out.write('%-8s %-8s %9.3f ms\n' % (case, name, seconds * 1e3))
+            else:
+                items = values[case]
+                seconds = best(lambda: map(escape, items), min_time) / len(items)
+                out.write('%-8s %-8s %9.0f ns\n' % (case, name, seconds * 1e9))
+            results.append((case, name, seconds))
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--cases', default=','.join(CASES),
+        help='cases, comma separated')
+    parser.add_option('-r', '--rows', type='int', default=ROWS,
+        help='values per case and rows of the table')
+    parser.add_option('-t', '--min-time', type='float', default=0.2,
+        help='minimum seconds of one of the 5 runs per row')
+    options, args = parser.parse_args(argv)
+    run(options.cases.split(','), options.rows, options.min_time)
+
+
+if __name__ == '__main__':
+    main()
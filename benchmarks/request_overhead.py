@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+""" Per-request overhead benchmark.
+
+Calls swinf.WSGIHandler in-process with a minimal handler, so the
+numbers are the cost of binding the request and response, dispatching
+and starting the response.
+
+Usage:
+    PYTHONPATH=. python benchmarks/request_overhead.py
+"""
+import sys
+import timeit
+from StringIO import StringIO
+from optparse import OptionParser
+
+import swinf
+from swinf.core.selector import add_route
+
+
+def make_environ(path='/bench/hello', query='a=1&b=2', cookie='sid=abc'):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'HTTP_COOKIE': cookie,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': StringIO(''),
+        'wsgi.errors': sys.stderr,
+    }
+
+
+def start_response(status, headers):
+    pass
+
+
+def hello():
+    return 'hello'
+
+
+def hello_params():
+    request = swinf.request
+    return '%s %s %s' % (request.method, request.GET['a'],
+        request.COOKIES['sid'])
+
+
+def measure(path, min_time=0.05, repeat=20):
+    """ Returns the best ns per WSGIHandler call on `path`. """
+    timer = timeit.default_timer
+    environ = make_environ(path)
+    handler = swinf.WSGIHandler
+    loops = 1
+    while True:
+        start = timer()
+        for _ in xrange(loops):
+            # a fresh environ per request, like a real server
+            for chunk in handler(dict(environ), start_response):
+                pass
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in xrange(repeat - 1):
+        start = timer()
+        for _ in xrange(loops):
+            for chunk in handler(dict(environ), start_response):
+                pass
+        best = min(best, timer() - start)
+    return best / loops * 1e9
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-t', '--min-time', type='float', default=0.05,
+        help='minimum seconds of one of the 20 runs per row')
+    options, args = parser.parse_args(argv)
+    add_route('/bench/hello', hello)
+    add_route('/bench/params', hello_params)
+    for path in ('/bench/hello', '/bench/params'):
+        sys.stdout.write('%-16s %10.0f ns/request\n' % \
+            (path, measure(path, options.min_time)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+""" Route dispatch benchmark.
+
+Builds synthetic route tables and measures `match_url` of
+swinf.core.selector in-process, no server involved.
+
+Usage:
+    PYTHONPATH=. python benchmarks/route_dispatch.py
+    PYTHONPATH=. python benchmarks/route_dispatch.py -s 100,1000 -d tree,linear
+
+Dispatch strategies:
+    tree        match_url as configured by default (route tree)
+    cache       match_url with enable_route_cache()
+    adaptive    match_url with enable_adaptive_routes()
+    linear      the old first-match scan over ROUTES_REGEXP, as a baseline
+
+Cases:
+    hit         urls spread over all routes of the table
+    miss        urls matching no route
+    last        the url of the last added regex route
+
+Reported are ns/op and objs/op, the gc tracked objects each lookup
+leaves behind (result tuples and param dicts, temporaries freed
+within the lookup are not counted).
+"""
+import gc
+import random
+import sys
+import timeit
+from optparse import OptionParser
+
+from swinf.core import selector
+
+SIZES = (10, 100, 1000, 10000)
+STRATEGIES = ('tree', 'cache', 'adaptive', 'linear')
+CASES = ('hit', 'miss', 'last')
+
+
+def reset_routes():
+    """ Empties the route tables and turns caches off. """
+    selector.ROUTES_SIMPLE.clear()
+    selector.ROUTES_REGEXP.clear()
+    selector.ROUTES_TREE.clear()
+    selector.disable_route_cache()
+    selector.enable_adaptive_routes(False)
+
+
+def build_routes(size, seed=0):
+    """ Adds `size` routes mixing static, ':param' and ':param#regex#'
+        forms. Returns (hit urls, miss urls, url of the last regex
+        route). """
+    rand = random.Random(seed)
+    hits, last = [], None
+    for i in xrange(size):
+        kind = i % 4
+        handler = lambda **kwargs: None
+        if kind == 0:
+            route = url = '/static%d/page' % i
+        elif kind == 1:
+            route = '/user%d/:id' % i
+            url = '/user%d/%d' % (i, rand.randint(1, 10 ** 6))
+        elif kind == 2:
+            route = '/post%d/:year#[0-9]{4}#/:slug' % i
+            url = '/post%d/%d/some-title' % (i, rand.randint(1990, 2030))
+        else:
+            route = '/api/v1/item%d/:id#[0-9]+#/edit' % i
+            url = '/api/v1/item%d/%d/edit' % (i, rand.randint(1, 10 ** 6))
+        selector.add_route(route, handler)
+        hits.append(url)
+        if kind:
+            last = url
+    rand.shuffle(hits)
+    misses = ['/missing%d/path/%d' % (i, rand.randint(1, 10 ** 6)) \
+            for i in xrange(max(len(hits), 100))]
+    return hits, misses, [last]
+
+
+def match_linear(url, method='GET'):
+    """ match_url before the route tree: static dict, then the first
+        matching regex of ROUTES_REGEXP. """
+    url = '/' + url.strip().lstrip('/')
+    handler = selector.ROUTES_SIMPLE.get(method, {}).get(url, None)
+    if handler:
+        return (handler, {})
+    for regex, handler in selector.ROUTES_REGEXP.get(method, []):
+        match = regex.match(url)
+        if match:
+            return (handler, match.groupdict())
+    return (None, None)
+
+
+def measure(match, urls, min_time=0.2):
+    """ Returns (ns/op, objs/op) of calling `match` on `urls`. """
+    timer = timeit.default_timer
+    count = len(urls)
+    # warm up, fills the caches of the cache strategy
+    for url in urls:
+        match(url)
+    loops, elapsed = 1, 0.0
+    while True:
+        start = timer()
+        for _ in xrange(loops):
+            for url in urls:
+                match(url)
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    ns = elapsed / (loops * count) * 1e9
+    # objects left behind, results are kept alive to be counted
+    kept = [None] * count
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for i, url in enumerate(urls):
+            kept[i] = match(url)
+        objs = float(gc.get_count()[0] - before) / count
+    finally:
+        gc.enable()
+    return ns, objs
+
+
+def run(sizes=SIZES, strategies=STRATEGIES, cases=CASES, min_time=0.2, \
+        out=sys.stdout):
+    out.write('%8s %-10s %-6s %12s %8s\n' % \
+        ('routes', 'strategy', 'case', 'ns/op', 'objs/op'))
+    results = []
+    for size in sizes:
+        reset_routes()
+        hits, misses, last = build_routes(size)
+        urls = {'hit': hits, 'miss': misses, 'last': last}
+        for strategy in strategies:
+            match = selector.match_url
+            if strategy == 'linear':
+                match = match_linear
+            for case in cases:
+                if strategy == 'cache':
+                    selector.enable_route_cache(len(urls[case]) * 2)
+                elif strategy == 'adaptive':
+                    selector.enable_adaptive_routes()
+                try:
+                    ns, objs = measure(match, urls[case], min_time)
+                finally:
+                    selector.disable_route_cache()
+                    selector.enable_adaptive_routes(False)
+                results.append((size, strategy, case, ns, objs))
+                out.write('%8d %-10s %-6s %12.0f %8.2f\n' % \
+                    (size, strategy, case, ns, objs))
+    reset_routes()
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--sizes', default=','.join(map(str, SIZES)),
+        help='route table sizes, comma separated')
+    parser.add_option('-d', '--strategies', default=','.join(STRATEGIES),
+        help='dispatch strategies, comma separated')
+    parser.add_option('-c', '--cases', default=','.join(CASES),
+        help='lookup cases, comma separated')
+    parser.add_option('-t', '--min-time', type='float', default=0.2,
+        help='minimum seconds measured per row')
+    options, args = parser.parse_args(argv)
+    run([int(s) for s in options.sizes.split(',')],
+        options.strategies.split(','), options.cases.split(','),
+        options.min_time)
+
+
+if __name__ == '__main__':
+    main()
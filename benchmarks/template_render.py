@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+""" Template rendering benchmark.
+
+Writes synthetic templates to a temporary directory and renders them
+with swinf.template in-process, the way template() does for a handler.
+
+Usage:
+    PYTHONPATH=. python benchmarks/template_render.py
+    PYTHONPATH=. python benchmarks/template_render.py -c table -r 1000
+
+Cases:
+    literal     a long page of static html with a few {{ }} values
+    table       a loop over a table of ROWS rows, three escaped cells each
+    nested      a chain of DEPTH templates, each one _include()s the next
+    code        a large {% %} code block, then a loop over its results
+
+Reported per case:
+    compile     ms to load and compile the template, its includes not
+    cold        ms of the first render with empty template caches, as
+                in a new process: lookup, compile and render
+    warm        ms of a render of the cached template
+    size        KB of the utf8 output
+    objs        gc tracked objects allocated and not freed during a
+                warm render, the output and its pieces mostly
+
+The bytecode cache is off, so cold runs compile every time.
+"""
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from optparse import OptionParser
+
+from swinf import config
+from swinf import template as engine
+
+CASES = ('literal', 'table', 'nested', 'code')
+ROWS = 10000
+DEPTH = 30
+
+
+def write(directory, name, source):
+    with open(os.path.join(directory, name + '.tpl'), 'w') as f:
+        f.write(source)
+
+
+def make_templates(directory, rows=ROWS, depth=DEPTH):
+    """ Writes the templates of the cases to `directory`. Returns
+    {case: (template name, render arguments)}. """
+    lines = ['<html><head><title>{{title}}</title></head><body>\n']
+    for i in xrange(2000):
+        lines.append('<p class="text">Lorem ipsum dolor sit amet, '
+            'consectetur adipisicing elit, line %d.</p>\n' % i)
+        if i % 500 == 0:
+            lines.append('<h2>{{title}} {{!footer}}</h2>\n')
+    lines.append('</body></html>\n')
+    write(directory, 'literal', ''.join(lines))
+
+    write(directory, 'table', '<table>\n'
+        '%% for row in rows:\n'
+        '<tr><td>{{row[0]}}</td><td>{{row[1]}}</td><td>{{row[2]}}</td></tr>\n'
+        '%% end\n'
+        '</table>\n')
+    table = [(i, '<user %d & co>' % i, '"user%d"@example.com' % i) \
+            for i in xrange(rows)]
+
+    for level in xrange(depth):
+        write(directory, 'nest%d' % level, '<div class="level%d">{{level}}\n'
+            '%%%% _include("nest%d", level=level + 1)\n'
+            '</div>\n' % (level, level + 1))
+    write(directory, 'nest%d' % depth, '<p>bottom {{level}}</p>\n')
+
+    lines = ['{%\n', 'values = []\n']
+    for i in xrange(300):
+        lines.append('v%d = (%d * 7 + len(title)) // 13\n' % (i, i))
+        lines.append('values.append(v%d)\n' % i)
+    lines.append('%}\n')
+    lines.append('<ul>\n%% for v in values:\n<li>{{v}}</li>\n%% end\n</ul>\n')
+    write(directory, 'code', ''.join(lines))
+
+    return {
+        'literal': ('literal', {'title': 'Literal <page>', 'footer': '<hr>'}),
+        'table': ('table', {'rows': table}),
+        'nested': ('nest0', {'level': 0}),
+        'code': ('code', {'title': 'Code'}),
+    }
+
+
+def reset_engine():
+    """ Empties the template caches, as in a new process. """
+    engine.TEMPLATES = None
+    engine.INDEXES.clear()
+
+
+def best(func, repeat):
+    """ Returns the best seconds of `repeat` calls of `func`. """
+    timer = timeit.default_timer
+    times = []
+    for _ in xrange(repeat):
+        start = timer()
+        func()
+        times.append(timer() - start)
+    return min(times)
+
+
+def measure(name, kwargs, lookup, min_time=0.2, repeat=5):
+    """ Returns (compile, cold, warm) seconds, output bytes and objs of
+    rendering template `name`. """
+    def compile():
+        engine.SimpleTemplate(path=name, lookup=lookup).compile
+    compile_time = best(compile, repeat)
+
+    def cold():
+        reset_engine()
+        engine.template(path=name, lookup=lookup, **kwargs)
+    cold_time = best(cold, repeat)
+
+    render = lambda: engine.template(path=name, lookup=lookup, **kwargs)
+    output = render()
+    timer = timeit.default_timer
+    loops = 1
+    while True:
+        start = timer()
+        for _ in xrange(loops):
+            render()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    warm_time = elapsed / loops
+    for _ in xrange(repeat - 1):
+        start = timer()
+        for _ in xrange(loops):
+            render()
+        warm_time = min(warm_time, (timer() - start) / loops)
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        kept = render()
+        objs = gc.get_count()[0] - before
+    finally:
+        gc.enable()
+    return compile_time, cold_time, warm_time, \
+            len(output.encode('utf8')), objs
+
+
+def run(cases=CASES, rows=ROWS, depth=DEPTH, min_time=0.2, out=sys.stdout):
+    config.debug = False
+    config.template.check_interval = None
+    config.template.bytecode_cache = None
+    directory = tempfile.mkdtemp(prefix='swinf-bench-')
+    results = []
+    try:
+        templates = make_templates(directory, rows, depth)
+        out.write('%-8s %12s %12s %12s %10s %8s\n' % \
+            ('case', 'compile ms', 'cold ms', 'warm ms', 'size KB', 'objs'))
+        for case in cases:
+            name, kwargs = templates[case]
+            reset_engine()
+            compile_time, cold, warm, size, objs = \
+                    measure(name, kwargs, [directory], min_time)
+            results.append((case, compile_time, cold, warm, size, objs))
+            out.write('%-8s %12.3f %12.3f %12.3f %10.1f %8d\n' % (case, \
+                compile_time * 1e3, cold * 1e3, warm * 1e3, size / 1024.0, objs))
+    finally:
+        reset_engine()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-c', '--cases', default=','.join(CASES),
+        help='cases, comma separated')
+    parser.add_option('-r', '--rows', type='int', default=ROWS,
+        help='rows of the table case')
+    parser.add_option('-d', '--depth', type='int', default=DEPTH,
+        help='templates included in a chain by the nested case')
+    parser.add_option('-t', '--min-time', type='float', default=0.2,
+        help='minimum seconds of one of the 5 warm runs per row')
+    options, args = parser.parse_args(argv)
+    run(options.cases.split(','), options.rows, options.depth,
+        options.min_time)
+
+
+if __name__ == '__main__':
+    main()
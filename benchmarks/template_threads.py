@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+""" Concurrent template rendering check.
+
+Renders and streams one cached page from many threads at once, each
+thread with its own values, and checks every output. The page extends
+a layout and _include()s a part in a loop, so the shared template,
+its layout and its subtemplate are all in use by many renders at a
+time. Exits with status 1 if an output belongs to another render.
+
+Usage:
+    PYTHONPATH=. python benchmarks/template_threads.py
+    PYTHONPATH=. python benchmarks/template_threads.py -n 32 -r 500
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+from optparse import OptionParser
+
+from swinf import config
+from swinf import template as engine
+
+THREADS = 16
+RENDERS = 300
+ITEMS = 20
+
+LAYOUT = '''<html><title>
+%% block title
+%% endblock
+</title><body>
+%% block body
+%% endblock
+</body></html>
+'''
+
+PAGE = '''%% extends 'layout'
+%% block title
+page {{n}}
+%% endblock
+%% block body
+%% for i in range(items):
+%% _include('part', n=n, i=i)
+%% end
+%% endblock
+'''
+
+PART = '''<p>{{n}}.{{i}}</p>
+'''
+
+
+def write(directory, name, source):
+    with open(os.path.join(directory, name + '.tpl'), 'w') as f:
+        f.write(source)
+
+
+def expected(n, items=ITEMS):
+    parts = u''.join([u'<p>%d.%d</p>\n' % (n, i) for i in xrange(items)])
+    return u'<html><title>\npage %d\n</title><body>\n%s</body></html>\n' % \
+            (n, parts)
+
+
+def run(threads=THREADS, renders=RENDERS, out=sys.stdout):
+    """ Returns the list of (n, output) of the wrong outputs. """
+    config.debug = False
+    config.template.check_interval = None
+    config.template.bytecode_cache = None
+    directory = tempfile.mkdtemp(prefix='swinf-threads-')
+    errors = []
+    start = threading.Event()
+    lookup = [directory]
+
+    def worker(k):
+        start.wait()
+        for j in xrange(renders):
+            n = k * renders + j
+            if j % 2:
+                output = u''.join(engine.stream_template(path='page', \
+                        lookup=lookup, n=n, items=ITEMS))
+            else:
+                output = engine.template(path='page', lookup=lookup, \
+                        n=n, items=ITEMS)
+            if output != expected(n):
+                errors.append((n, output))
+
+    try:
+        write(directory, 'layout', LAYOUT)
+        write(directory, 'page', PAGE)
+        write(directory, 'part', PART)
+        engine.TEMPLATES = None
+        engine.INDEXES.clear()
+        workers = [threading.Thread(target=worker, args=(k,)) \
+                for k in xrange(threads)]
+        # switch threads often, in the middle of renders
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(10)
+        try:
+            for thread in workers:
+                thread.start()
+            began = timeit.default_timer()
+            start.set()
+            for thread in workers:
+                thread.join()
+            elapsed = timeit.default_timer() - began
+        finally:
+            sys.setcheckinterval(interval)
+    finally:
+        engine.TEMPLATES = None
+        engine.INDEXES.clear()
+        shutil.rmtree(directory, ignore_errors=True)
+    out.write('%d threads, %d renders in %.2f s, %d wrong outputs\n' % \
+            (threads, threads * renders, elapsed, len(errors)))
+    for n, output in errors[:3]:
+        out.write('render %d got %r\n' % (n, output[:80]))
+    return errors
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-n', '--threads', type='int', default=THREADS,
+        help='rendering threads')
+    parser.add_option('-r', '--renders', type='int', default=RENDERS,
+        help='renders per thread, every second one streamed')
+    options, args = parser.parse_args(argv)
+    if run(options.threads, options.renders):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
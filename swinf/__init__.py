@@ -3,19 +3,28 @@ __version__ = ('0', '0', '5')
 __license__ = 'MIT'
 
 import cgi
+import hashlib
 from Cookie import SimpleCookie
 import os
-import mimetypes
-import threading
-import time
 import traceback
+from cStringIO import StringIO
 from urlparse import parse_qs
 from swinf.core import ctx
 from swinf.core.exceptions import *
 from swinf.core.middleware import HooksAdapter, HandlerHookAdapter
 from swinf.core.selector import *
-from swinf.utils.functional import DictProperty
-from swinf.utils import Storage, MyBuffer
+from swinf.core.selector import mark_registration
+from swinf.utils import Storage, MyBuffer, ContextVar, ContextProxy
+from swinf.utils.formparser import parse_form_data
+from swinf.utils import compress
+from swinf.utils.static import StaticFiles, load_static_file
+from swinf.utils.cache import cached, MemoryCache, DiskCache, SingleFlight
+
+# zero-copy file sending, os.sendfile is new in Python 3.3
+try:
+    from sendfile import sendfile
+except ImportError:
+    sendfile = getattr(os, 'sendfile', None)
 
 
 # global default config of swinf
@@ -23,11 +32,13 @@ from swinf.utils import Storage, MyBuffer
 config = Storage({
     'debug':False,
     'optimize':False,
+    # give buffered bodies without an ETag a content hash ETag
+    'hash_etags':False,
 
     'template' : Storage({
 
         # extensions of html template file
-        'extensions' :  ['', 'tpl', 'shtml'],
+        'extensions' :  ['', '.tpl', '.shtml'],
         'lookup':       [r'./view/'],
         'static_file_path':     r'./view/static',
 
@@ -40,12 +51,76 @@ config = Storage({
         'single_line_code':     '%%',
         'multi_code_begin':     '{%',
         'multi_code_end':       '%}', 
-    })
+
+        # seconds between the mtime checks of a cached template and 
+        # its files, None never checks. Debug mode checks every render
+        'check_interval':       None,
+
+        # characters per chunk of stream_template()
+        'stream_chunk_size':    4096,
+
+        # directory of marshalled compiled templates, None to disable
+        'bytecode_cache':       None,
+
+        # bounds of the cache of loaded templates
+        'cache_max_entries':    1000,
+        'cache_max_bytes':      16 * 1024 * 1024,
+
+        # bounds of the {% cache %} fragment cache
+        'fragment_max_entries': 10000,
+        'fragment_max_bytes':   16 * 1024 * 1024,
+    }),
+
+    # limits of request bodies, exceeding one gives a 413 response
+    'request' : Storage({
+        'max_body_size':    10 * 1024 * 1024,
+        # non-file fields only
+        'max_field_size':   1024 * 1024,
+        'max_fields':       1000,
+        # uploaded files larger than this are spooled to disk
+        'spool_threshold':  512 * 1024,
+        'chunk_size':       64 * 1024,
+    }),
+
+    # cache of the files sent by send_file
+    'static' : Storage({
+        'cache':            True,
+        # seconds a cached file is sent without a stat() of it
+        'revalidate':       1.0,
+        'max_entries':      1024,
+        # files up to max_file_size bytes are held in memory, 
+        # max_bytes in total
+        'max_bytes':        16 * 1024 * 1024,
+        'max_file_size':    256 * 1024,
+    }),
+
+    # full-page cache of handlers decorated by cached()
+    'page_cache' : Storage({
+        # 'memory', 'disk' or a cache object with get() and set()
+        'backend':      'memory',
+        'max_entries':  10000,
+        'max_bytes':    32 * 1024 * 1024,
+        # directory of the disk backend
+        'path':         './cache/pages',
+    }),
+
+    # gzip/deflate responses for clients accepting it
+    'compression' : Storage({
+        'enabled':  False,
+        'level':    6,
+        # bodies smaller than this are sent as they are
+        'min_size': 1024,
+        # compressible content types, matched as prefixes
+        'types':    ('text/', 'application/json', 'application/javascript',
+                    'application/x-javascript', 'application/xml',
+                    'image/svg+xml'),
+    }),
 })
 
 ERROR_HANDLER = {}
 
-from swinf.utils.html import HTTP_CODES
+from swinf.utils.html import HTTP_CODES, http_date, parse_date, \
+        make_etag, etag_matches, parse_range_header
 
 class HandlerHooks(HooksAdapter):
     """ Containing all processors to run when WSGIHandler is called.  
@@ -56,6 +131,10 @@ class HandlerHooks(HooksAdapter):
             raise NotImplementAdapterError(pros_obj.__class__, HandlerHookAdapter)
         self[name] = pros_obj
 
+    def __setitem__(self, name, pros_obj):
+        mark_registration()
+        HooksAdapter.__setitem__(self, name, pros_obj)
+
     def process(self, handler, **kwargs):
         for key, hook in self.items():
             hook.hook_start()
@@ -72,22 +151,33 @@ _buffer = MyBuffer()
 
 def WSGIHandler(environ, start_response):
     """ The Swinf WSGI-handler """
-    global request
-    global response
-    request.bind(environ)
-    response.bind()
+    request = Request(environ)
+    response = Response()
+    current_request.set(request)
+    current_response.set(response)
+    try:
+        return _handle(environ, start_response, request, response)
+    finally:
+        current_request.reset()
+        current_response.reset()
 
+
+def _handle(environ, start_response, request, response):
+    """ Runs the handler of a request and starts the response. """
     # Request dynamic route
     try:
         handler, args = match_url(request.path, request.method)
-        print 'handler: ', handler
         if not handler:
             raise HTTPError(404, r"Not found")
-        global handler_hooks
-        output = handler_hooks.process(handler, **args)
-        #output = handler(**args)
+        policy = getattr(handler, 'cache_policy', None)
+        if policy is not None and request.method in ('GET', 'HEAD'):
+            output = _cached_output(policy, handler, args, environ, \
+                    request, response)
+        else:
+            output = handler_hooks.process(handler, **args)
+            output = _prepare_output(output, environ, request, response)
     except BreakSwinf, shard:
-        output = shard.output
+        output = _prepare_output(shard.output, environ, request, response)
     except Exception, exception:
         response.status = getattr(exception, 'http_status', 500)
         errorhandler = ERROR_HANDLER.get(response.status, None)
@@ -95,6 +185,7 @@ def WSGIHandler(environ, start_response):
         if errorhandler:
             try:
                 output = errorhandler(exception)
+                output = _prepare_output(output, environ, request, response)
             except:
                 output = "Exception within error handler! application stoped!"
         else:
@@ -107,27 +198,290 @@ def WSGIHandler(environ, start_response):
 
         if response.status == 500:
             request._environ['wsgi.errors'].write("Error (500) on '%s': %s\n" % (request.path, exception))
-    # Files
-    if hasattr(output, 'read'):
-        fileoutput = output
-        if 'wsgi.file_wrapper' in environ:
-            output = environ['wsgi.file_wrapper'](fileoutput)
-        else:
-            output = iter(lambda: fileoutput.read(8192), '')
-    elif isinstance(output, str):
-        output = [output]
+        if isinstance(output, basestring):
+            output = _prepare_output(output, environ, request, response)
     
+    # Conditional GET
+    if response.status == 200:
+        if config.hash_etags and isinstance(output, list) and \
+                'ETag' not in response.header:
+            response.header['ETag'] = _body_etag(output)
+        if _not_modified(environ, response):
+            output = _send_not_modified(output, response)
+
+    if config.compression.enabled:
+        output = _compress_output(output, environ, response)
+
     # Cookies
-    for c in response.COOKIES.values():
-        response.header.add('Set-Cookie', c.OutputString())
+    if response._COOKIES:
+        for c in response._COOKIES.values():
+            response.header.add('Set-Cookie', c.OutputString())
 
     status = '%d %s' % (response.status, HTTP_CODES[response.status])
     start_response(status, list(response.header.items()))
     return output
 
 
-class Request(threading.local):
-    """ A single request using thread-local namespace. """
+def _prepare_output(output, environ, request, response):
+    """ Turns what a handler returned into a WSGI iterable of byte 
+    strings, unicode is encoded with the response charset. 
+
+    Generators and other iterables are streamed: the first chunk is
+    pulled here, so code before the first `yield` can still set the 
+    status and headers or raise an error, and the rest is pulled 
+    by the server chunk by chunk. """
+    if output is None:
+        return []
+    if isinstance(output, str):
+        return [output]
+    if isinstance(output, unicode):
+        return [output.encode(response.charset)]
+    # Files
+    if isinstance(output, FileWrapper):
+        if output.offset or output.length is not None or \
+                'wsgi.file_wrapper' not in environ:
+            return output
+        output = output.fp
+    if hasattr(output, 'read'):
+        if 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](output)
+        return FileWrapper(output)
+    if isinstance(output, (list, tuple)):
+        charset = response.charset
+        return [chunk.encode(charset) if isinstance(chunk, unicode) \
+                else chunk for chunk in output]
+    iterator = iter(output)
+    first = ''
+    try:
+        while not first:
+            first = next(iterator)
+    except StopIteration:
+        if hasattr(output, 'close'):
+            output.close()
+        return []
+    return StreamingBody(output, iterator, first, request, response)
+
+
+PAGE_CACHE = None
+_page_flights = SingleFlight()
+
+
+def page_cache():
+    """ The default cache of cached() handlers, made from 
+    config.page_cache on first use. """
+    global PAGE_CACHE
+    if PAGE_CACHE is None:
+        options = config.page_cache
+        if options.backend == 'memory':
+            PAGE_CACHE = MemoryCache(options.max_entries, options.max_bytes)
+        elif options.backend == 'disk':
+            PAGE_CACHE = DiskCache(options.path)
+        else:
+            PAGE_CACHE = options.backend
+    return PAGE_CACHE
+
+
+def _cached_output(policy, handler, args, environ, request, response):
+    """ Output of a handler with a cache policy. A hit restores the 
+    stored status, headers and body without running the handler 
+    hooks, concurrent misses of a key wait for one rendering. """
+    cache = policy.backend or page_cache()
+    key = policy.key(request)
+    page = cache.get(key)
+    if page is None:
+        render = lambda: _render_page(handler, args, environ, request, \
+                response, cache, key, policy.ttl)
+        page, shared = _page_flights.do(key, render)
+        if not shared:
+            return [page[2]]
+        if page is None or not page[3]:
+            # a failed or personal page is rendered by each request
+            output = handler_hooks.process(handler, **args)
+            return _prepare_output(output, environ, request, response)
+    status, headers, body = page[:3]
+    response.status = status
+    response.header = HeaderDict([(name, list(value) if \
+        isinstance(value, tuple) else value) for name, value in headers])
+    return [body]
+
+
+def _render_page(handler, args, environ, request, response, cache, key, ttl):
+    """ Runs the handler and stores the response with an ETag if it is
+    a 200 without cookies. Returns (status, headers, body, stored). """
+    output = handler_hooks.process(handler, **args)
+    output = _prepare_output(output, environ, request, response)
+    try:
+        body = ''.join(output)
+    finally:
+        if hasattr(output, 'close'):
+            output.close()
+    header = response.header
+    stored = response.status == 200 and not response._COOKIES
+    if stored and 'ETag' not in header:
+        header['ETag'] = _body_etag([body])
+    headers = tuple([(name, tuple(value) if isinstance(value, list) \
+        else value) for name, value in dict.items(header)])
+    page = (response.status, headers, body, stored)
+    if stored:
+        cache.set(key, page, ttl)
+    return page
+
+
+def _body_etag(output):
+    digest = hashlib.md5()
+    for chunk in output:
+        digest.update(chunk)
+    return make_etag(digest.hexdigest())
+
+
+def _not_modified(environ, response):
+    """ Whether the client's copy is still fresh, by If-None-Match 
+    against the ETag or else If-Modified-Since against the 
+    Last-Modified header of the response. """
+    if response.status != 200 or \
+            environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+        return False
+    header = response.header
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return 'ETag' in header and etag_matches(header['ETag'], if_none_match)
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and 'Last-Modified' in header:
+        last_modified = parse_date(header['Last-Modified'])
+        since = parse_date(if_modified_since)
+        return None not in (last_modified, since) and last_modified <= since
+    return False
+
+
+def _send_not_modified(output, response):
+    if hasattr(output, 'close'):
+        output.close()
+    response.status = 304
+    for key in ('Content-Length', 'Content-Type'):
+        if key in response.header:
+            del response.header[key]
+    return []
+
+
+def _compress_output(output, environ, response):
+    """ Compresses the output if the client accepts it and the 
+    content type and size are worth it. Buffered bodies get a new 
+    Content-Length, streamed ones are compressed chunk by chunk. """
+    options = config.compression
+    header = response.header
+    if response.status < 200 or response.status in (204, 206, 304) or \
+            'Content-Encoding' in header or 'Content-Range' in header or \
+            environ.get('REQUEST_METHOD') == 'HEAD':
+        return output
+    content_type = header['Content-Type'] if 'Content-Type' in header else ''
+    content_type = content_type.split(';')[0].strip().lower()
+    if not content_type.startswith(tuple(options.types)):
+        return output
+    if isinstance(output, list):
+        if sum(map(len, output)) < options.min_size:
+            return output
+    elif 'Content-Length' in header:
+        try:
+            if int(header['Content-Length']) < options.min_size:
+                return output
+        except (TypeError, ValueError):
+            pass
+    # compressed for the clients that accept it, so caches must vary
+    header.add('Vary', 'Accept-Encoding')
+    encoding = compress.accept_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+    if not encoding:
+        return output
+    # the encoded body is no longer byte-identical
+    if 'ETag' in header:
+        header['ETag'] = make_etag(header['ETag'], weak=True)
+    if isinstance(output, list):
+        body = compress.compress(output, encoding, options.level)
+        header['Content-Length'] = str(len(body))
+        header['Content-Encoding'] = encoding
+        return [body]
+    if 'Content-Length' in header:
+        del header['Content-Length']
+    header['Content-Encoding'] = encoding
+    return compress.CompressedBody(output, encoding, options.level)
+
+
+class StreamingBody(object):
+    """ WSGI iterable of a streamed handler output.
+
+    Chunks are encoded one by one as the server pulls them, the 
+    request and response of the call stay reachable while the 
+    handler runs, and close() is passed on to the handler output 
+    as the WSGI spec requires. """
+    def __init__(self, output, iterator, first, request, response):
+        self.output, self.iterator = output, iterator
+        self.first = first
+        self.request, self.response = request, response
+        self.charset = response.charset
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.first is not None:
+            chunk, self.first = self.first, None
+        else:
+            current_request.set(self.request)
+            current_response.set(self.response)
+            try:
+                chunk = next(self.iterator)
+            finally:
+                current_request.reset()
+                current_response.reset()
+        if isinstance(chunk, unicode):
+            return chunk.encode(self.charset)
+        return chunk
+
+    def close(self):
+        if hasattr(self.output, 'close'):
+            self.output.close()
+
+
+class FileWrapper(object):
+    """ Reads a file in blocks and closes it, used when the server 
+    has no wsgi.file_wrapper. 
+
+    `offset` and `length` limit it to a byte range of the file, a 
+    server that knows this class can send that range by sendfile(). """
+    def __init__(self, fp, block_size=8192, offset=0, length=None):
+        self.fp, self.block_size = fp, block_size
+        self.offset, self.length = offset, length
+
+    def __iter__(self):
+        read, block_size = self.fp.read, self.block_size
+        if self.offset:
+            self.fp.seek(self.offset)
+        remaining = self.length
+        if remaining is None:
+            chunk = read(block_size)
+            while chunk:
+                yield chunk
+                chunk = read(block_size)
+            return
+        while remaining > 0:
+            chunk = read(min(block_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.fp.close()
+
+
+class Request(object):
+    """ A single request, created for every call of WSGIHandler and
+    reachable through `swinf.request` or `current_request.get()`. """
+    __slots__ = ('_environ', 'path', '_GET', '_POST', '_GETPOST', '_COOKIES')
+
+    def __init__(self, environ=None):
+        if environ is not None:
+            self.bind(environ)
+
     def bind(self, environ):
         """ Binds the environment of the current request to this request handler. """
         self._environ = environ
@@ -135,21 +489,21 @@ class Request(threading.local):
         self._POST = None
         self._GETPOST = None
         self._COOKIES = None
-        self.path = self._environ.get('PATH_INFO', '/').strip()
+        self.path = environ.get('PATH_INFO', '/').strip()
         if not self.path.startswith('/'):
             self.path = '/' + self.path
 
-    @DictProperty('_environ', 'swinf.method', read_only=True)
+    @property
     def method(self):
         """ Returns the request method (GET, POST, PUT, DELETE, ...) """
         return self._environ.get('REQUEST_METHOD', 'GET').upper()
     
-    @DictProperty('_environ', 'swinf.query_string', read_only=True)
+    @property
     def query_string(self):
         """ Content of QUERY_STRING. """
         return self._environ.get('QUERY_STRING', '')
 
-    @DictProperty('_environ', 'swinf.input_length', read_only=True)
+    @property
     def input_length(self):
         """ Content of CONTENT_LENGTH. """
         try:
@@ -157,7 +511,7 @@ class Request(threading.local):
         except ValueError:
             return 0
 
-    @DictProperty('_environ', 'swinf.GET', read_only=True)
+    @property
     def GET(self):
         """ Returns a dict with GET parameters."""
         if self._GET is None:
@@ -170,47 +524,59 @@ class Request(threading.local):
                     self._GET[key] = value
         return self._GET
     
-    @DictProperty('_environ', 'swinf.POST', read_only=True)
+    @property
     def POST(self):
-        """ Returns a dict with POST parameters."""
+        """ Returns a dict with POST parameters, uploaded files are 
+        FileUpload objects. The body is parsed on first access, 
+        within the limits of config.request. """
         if self._POST is None:
             self._POST = {}
-            raw_data = cgi.FieldStorage(fp=self._environ['wsgi.input'])
-            for key in raw_data:
-                if raw_data[key].filename:
-                    self._POST[key] = raw_data[key]
-                elif isinstance(raw_data[key], list):
-                    self._POST[key] = [v.value for v in raw_data[key]]
+            for key, value in parse_form_data(self._environ, **config.request):
+                if key not in self._POST:
+                    self._POST[key] = value
+                elif isinstance(self._POST[key], list):
+                    self._POST[key].append(value)
                 else:
-                    self._POST[key] = raw_data[key].value
+                    self._POST[key] = [self._POST[key], value]
         return self._POST
 
-    @DictProperty('_environ', 'swinf.path_info', read_only=True)
+    @property
     def path_info(self):
         return self._environ.get('PATH_INFO', '')
 
-    @DictProperty('_environ', 'swinf.remote_addr', read_only=True)
+    @property
     def remote_addr(self):
         return cgi.escape(self._environ.get('REMOTE_ADDR'))
     
-    @DictProperty('_environ', 'swinf.params', read_only=True)
+    @property
     def params(self):
         """ Returns a mix of GET and POST data. POST overwrites GET. """
         if self._GETPOST is None:
             self._GETPOST = dict(self.GET)
             self._GETPOST.update(self.POST)
+        return self._GETPOST
 
-    @DictProperty('_environ', 'swinf.request.cookies', read_only=True)
+    @property
     def COOKIES(self):
-        cookies = SimpleCookie(self._environ.get('HTTP_COOKIE',''))
-        self._COOKIES = {}
-        for cookie in cookies.values():
-            self._COOKIES[cookie.key] = cookie.value
+        if self._COOKIES is None:
+            cookies = SimpleCookie(self._environ.get('HTTP_COOKIE',''))
+            self._COOKIES = {}
+            for cookie in cookies.values():
+                self._COOKIES[cookie.key] = cookie.value
         return self._COOKIES
 
 
-class Response(threading.local):
-    """ Represents a single response using thread-local namespace. """
+class Response(object):
+    """ Represents a single response, created for every call of 
+    WSGIHandler and reachable through `swinf.response` or 
+    `current_response.get()`. """
+    __slots__ = ('_COOKIES', 'status', 'header', 'error')
+
+    def __init__(self):
+        self._COOKIES = None
+        self.status = 200
+        self.header = HeaderDict(CONTENT_TYPE_HTML)
+        self.error = None
 
     def bind(self):
         """ Clears old data and creates a new Response object. """
@@ -232,6 +598,17 @@ class Response(threading.local):
         for k in kargs:
             self.COOKIES[key][k] = kargs[k]
 
+    @property
+    def charset(self):
+        """ Charset of the 'Content-Type' header, defaults to utf8. """
+        try:
+            content_type = self.header['Content-Type']
+        except KeyError:
+            return 'utf8'
+        if 'charset=' in content_type:
+            return content_type.split('charset=')[-1].split(';')[0].strip()
+        return 'utf8'
+
     def get_content_type(self):
         """ Gives access to the 'Content-Type' header and defaults to 'text/html'. """
         return self.header['Content-Type']
@@ -244,6 +621,9 @@ class Response(threading.local):
     content_type = property(get_content_type, set_content_type, None, get_content_type.__doc__)
 
 
+CONTENT_TYPE_HTML = {'Content-Type': 'text/html'}
+
+
 class HeaderDict(dict):
     """ A dictionary with case insensitive (titled) keys.
 
@@ -295,36 +675,130 @@ def redirect(url, code = 307):
     raise BreakSwinf("")
 
 
+def conditional(etag=None, last_modified=None, weak=False):
+    """ Declares the ETag and/or Last-Modified time of the response 
+    up front. If the client's copy is still fresh the handler stops 
+    here and a 304 Not Modified is sent, nothing is rendered.
+
+    Example:
+        @route('/article/:id')
+        def article(id):
+            article = load(id)
+            conditional(etag=article.version)
+            return template(path='article', article=article)
+    """
+    if etag is not None:
+        response.header['ETag'] = make_etag(etag, weak)
+    if last_modified is not None:
+        response.header['Last-Modified'] = http_date(last_modified)
+    if _not_modified(current_request.get()._environ, current_response.get()):
+        raise BreakSwinf("")
+
+
 def send_file(filename, root="", guessmime = True, mimetype = 'text/plain'):
     """ Aborts execution and sends a static files as response. 
-        if filename.startswith("/"), that means a full path """
-    root = os.path.abspath(root) + '/'
-    filename = os.path.normpath(filename).strip('/')
-    filename = os.path.join(root, filename)
-    if not filename.startswith(root):
-        abort(401, "Access denied.")
-    elif not os.path.exists(filename) or not os.path.isfile(filename):
-        abort(404, "File does not exists")
-    elif not os.access(filename, os.R_OK):
-        abort(401, "You do not have permission to access this file.")
-
-    if guessmime:
-        guess = mimetypes.guess_type(filename)[0]
-        if guess:
-            response.content_type = guess
-        elif mimetype:
-            response.content_type = mimetype
-    elif mimetype:
-        response.content_type = mimetype
-
-    stats = os.stat(filename)
-    if 'Content-Length' not in response.header:
-        response.header['Content-Length'] = str(stats.st_size)
-    if 'Last-Modified' not in response.header:
-        ts = time.gmtime(stats.st_mtime)
-        ts = time.strftime("%a, %d %b %Y %H:%M:%S +0000", ts)
-        response.header['Last-Modified'] = ts
-    raise BreakSwinf(open(filename, 'rb'))
+        if filename.startswith("/"), that means a full path 
+
+        Resolved files are cached by `static_files()`, small ones 
+        are sent from memory. """
+    files = static_files()
+    if files is not None:
+        entry = files.lookup(filename, root, guessmime, mimetype)
+    else:
+        entry = load_static_file(filename, root, guessmime, mimetype)
+
+    header = response.header
+    if entry.content_type:
+        header['Content-Type'] = entry.content_type
+    for key, value in entry.headers:
+        if key not in header:
+            header[key] = value
+    size = entry.size
+    environ = current_request.get()._environ
+    if _not_modified(environ, current_response.get()):
+        raise BreakSwinf("")
+
+    # Ranges
+    ranges = None
+    if 'HTTP_RANGE' in environ and response.status == 200 and \
+            _if_range(environ, response):
+        ranges = parse_range_header(environ['HTTP_RANGE'], size)
+    if ranges is None:
+        if entry.body is not None:
+            raise BreakSwinf([entry.body])
+        raise BreakSwinf(FileWrapper(entry.open()))
+    if not ranges:
+        response.status = 416
+        response.header['Content-Range'] = 'bytes */%d' % size
+        del response.header['Content-Length']
+        raise BreakSwinf("")
+    response.status = 206
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response.header['Content-Range'] = 'bytes %d-%d/%d' % \
+            (start, end - 1, size)
+        response.header['Content-Length'] = str(end - start)
+        if entry.body is not None:
+            raise BreakSwinf([entry.body[start:end]])
+        raise BreakSwinf(FileWrapper(entry.open(), offset=start, \
+            length=end - start))
+    fp = StringIO(entry.body) if entry.body is not None else entry.open()
+    content_type = response.content_type
+    boundary = hashlib.md5(os.urandom(16)).hexdigest()
+    parts = [('\r\n--%s\r\nContent-Type: %s\r\n'
+              'Content-Range: bytes %d-%d/%d\r\n\r\n' % \
+              (boundary, content_type, start, end - 1, size), start, end) \
+              for start, end in ranges]
+    tail = '\r\n--%s--\r\n' % boundary
+    response.content_type = 'multipart/byteranges; boundary=%s' % boundary
+    response.header['Content-Length'] = str(len(tail) + \
+        sum(len(head) + end - start for head, start, end in parts))
+    raise BreakSwinf(_byteranges(fp, parts, tail))
+
+
+STATIC_FILES = None
+
+
+def static_files():
+    """ The StaticFiles cache of send_file, made from config.static 
+    on first use. None if config.static.cache is off. 
+
+    Example:
+        swinf.static_files().info()     # hit rate, bytes in memory
+    """
+    global STATIC_FILES
+    options = config.static
+    if not options.cache:
+        return None
+    if STATIC_FILES is None:
+        STATIC_FILES = StaticFiles(options.max_entries, options.max_bytes, \
+            options.max_file_size, options.revalidate)
+    return STATIC_FILES
+
+
+def _if_range(environ, response):
+    """ Whether an If-Range precondition allows the Range header, 
+    it must equal the Last-Modified date or a strong ETag. """
+    if_range = environ.get('HTTP_IF_RANGE', '').strip()
+    if not if_range:
+        return True
+    header = response.header
+    if if_range.startswith('"'):
+        etag = header['ETag'] if 'ETag' in header else ''
+        return not etag.startswith('W/') and etag == if_range
+    return 'Last-Modified' in header and header['Last-Modified'] == if_range
+
+
+def _byteranges(fp, parts, tail, block_size=8192):
+    """ Yields a multipart/byteranges body of the file `fp`. """
+    try:
+        for head, start, end in parts:
+            yield head
+            for chunk in FileWrapper(fp, block_size, start, end - start):
+                yield chunk
+        yield tail
+    finally:
+        fp.close()
 
 
 def validate(**vkargs):
@@ -332,7 +806,7 @@ def validate(**vkargs):
     and handle ValueError and missing arguments by raising HTTPError(400)"""
     def decorator(func):
         def wrapper(**kargs):
-            for key in kargs:
+            for key in vkargs:
                 if key not in kargs:
                     abort(400, 'Missing parameter: %s' % key)
                 try:
@@ -340,7 +814,8 @@ def validate(**vkargs):
                 except ValueError:
                     abort(400, 'Wrong parameter form at for: %s' % key)
             return func(**kargs)
-        return decorator
+        return wrapper
+    return decorator
 
 
 # Error handling
@@ -352,6 +827,7 @@ def error(code=500):
         def set_error_handler(code, handler):
             code = int(code)
             ERROR_HANDLER[code] = handler
+            mark_registration()
         set_error_handler(code, handler)
         return handler
     return wrapper
@@ -373,11 +849,66 @@ class ServerAdaper(object):
 
 class WSGIRefServer(ServerAdaper):
     def run(self, handler):
-        from wsgiref.simple_server import make_server
-        srv = make_server(self.host, self.port, handler)
+        from wsgiref.simple_server import make_server, \
+                ServerHandler, WSGIRequestHandler
+
+        class FileServerHandler(ServerHandler):
+            # send files and file ranges by sendfile() if possible
+            wsgi_file_wrapper = FileWrapper
+
+            def sendfile(self):
+                return _wsgiref_sendfile(self)
+
+        class RequestHandler(WSGIRequestHandler):
+            # WSGIRequestHandler.handle with FileServerHandler
+            def handle(self):
+                self.raw_requestline = self.rfile.readline(65537)
+                if len(self.raw_requestline) > 65536:
+                    self.requestline = self.request_version = self.command = ''
+                    self.send_error(414)
+                    return
+                if not self.parse_request():
+                    return
+                handler = FileServerHandler(self.rfile, self.wfile, \
+                        self.get_stderr(), self.get_environ())
+                handler.request_handler = self
+                handler.run(self.server.get_app())
+
+        srv = make_server(self.host, self.port, handler, \
+                handler_class=RequestHandler)
         srv.serve_forever()
 
 
+def _wsgiref_sendfile(handler):
+    """ Writes the FileWrapper result of a wsgiref handler straight 
+    from the file to the socket. Returns False to fall back to the 
+    normal iteration if sendfile() or a file descriptor is missing. """
+    wrapper = handler.result
+    if sendfile is None or not hasattr(wrapper.fp, 'fileno'):
+        return False
+    try:
+        fd = wrapper.fp.fileno()
+        sock = handler.request_handler.connection.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+    offset = wrapper.offset
+    if wrapper.length is None:
+        remaining = os.fstat(fd).st_size - offset
+    else:
+        remaining = wrapper.length
+    if not handler.headers_sent:
+        handler.send_headers()
+    handler._flush()
+    while remaining > 0:
+        sent = sendfile(sock, fd, offset, remaining)
+        if not sent:
+            break
+        offset += sent
+        remaining -= sent
+        handler.bytes_sent += sent
+    return True
+
+
 def run(host='127.0.0.1', port=8080, \
             server=WSGIRefServer, optimize=False, **kargs):
     """ Runs swinf as a web server, using Python's 
@@ -411,8 +942,11 @@ def run(host='127.0.0.1', port=8080, \
 
 
 
-request = Request()
-response = Response()
+# the Request and Response of the running WSGIHandler call
+current_request = ContextVar('swinf.request')
+current_response = ContextVar('swinf.response')
+request = ContextProxy(current_request)
+response = ContextProxy(current_response)
 
 @error(500)
 def error500(exception):
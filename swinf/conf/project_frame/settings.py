@@ -14,7 +14,7 @@ config.optimize = False
 # swinf template settins
 config.template.update({
     # extensions of html template file
-    'extensions' :  ['', 'tpl', 'shtml'],
+    'extensions' :  ['', '.tpl', '.shtml'],
     'lookup':       [r'./view/'],
     'static_file_path':     r'./view/static',
 
@@ -28,6 +28,16 @@ config.template.update({
     'single_line_code':     '%%',
     'multi_code_begin':     '{%',
     'multi_code_end':       '%}', 
+
+    # compiled templates are kept here between restarts
+    'bytecode_cache':   os.path.join(PROJECT_PATH, 'cache', 'templates'),
+})
+
+# gzip/deflate compression of text responses
+config.compression.update({
+    'enabled':  True,
+    'level':    6,
+    'min_size': 1024,
 })
 
 # built-in server settings
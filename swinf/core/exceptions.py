@@ -34,3 +34,9 @@ class TemplateError(HTTPError):
         HTTPError.__init__(self, 500, message)
 
 
+class TemplateSyntaxError(TemplateError):
+    """ A template that does not compile, `lineno` is the line of the 
+    template source. """
+    def __init__(self, message, filename=None, lineno=None):
+        TemplateError.__init__(self, message)
+        self.filename, self.lineno = filename, lineno
@@ -2,15 +2,43 @@
 # define route and corresponding handler here
 # borrow Route from bottle.py (http://bottlepy.org/docs/dev/)
 import re
+import os
+import sre_constants
+import sre_parse
+import sys
+import hashlib
+import importlib
 import inspect
+import json
+import uuid
+from swinf.core.exceptions import SwinfError
+from swinf.utils import LRUCache
+from swinf.utils.cache import cached
 
 __all__ = [
     "match_url", "route", "handler",
     "handler_walk", "join_handler_space",
+    "enable_route_cache", "disable_route_cache",
+    "enable_adaptive_routes", "route_hits",
+    "add_converter",
 ]
 
 ROUTES_SIMPLE = {}
 ROUTES_REGEXP = {}
+# method -> RouteTree, index of ROUTES_REGEXP
+ROUTES_TREE = {}
+# (method, url) -> (handler, params items), None if disabled
+ROUTE_CACHE = None
+# count regex route matches and move hot fallback routes forward
+ADAPTIVE_ROUTES = False
+# name -> (regex, conversion func or None), used as ':id<int>'
+ROUTE_CONVERTERS = {
+    'int':      (r'-?\d+', int),
+    'float':    (r'-?\d+(?:\.\d+)?', float),
+    'path':     (r'.+', None),
+    'uuid':     (r'[0-9a-fA-F]{8}-(?:[0-9a-fA-F]{4}-){3}[0-9a-fA-F]{12}', \
+                    uuid.UUID),
+}
 
 
 def compile_route(route):
@@ -19,48 +47,414 @@ def compile_route(route):
 
     Routes may contain some special syntax.
     Example: '/user/:id/:action' will match '/user/5/kiss' 
-        with {'id':'5', 'action':'kiss'} """
+        with {'id':'5', 'action':'kiss'} 
+    
+    A wildcard may name a converter of ROUTE_CONVERTERS:
+    Example: '/user/:id<int>' will match '/user/5' with {'id':5} """
     route = route.strip().lstrip('$^/').rstrip('$^')
+    return re.compile('^/%s$' % _route_regex(route))
+
+
+def _route_regex(route):
+    """ Translates the wildcards of a (stripped) route to regex groups. """
     # Something like: '/user/:id#[0-9]#' will match
     # '/user/5' with {id:5}
     # trans to regrex format :r'/user/(?P<id>[0-9])'
-    route = re.sub(r':([a-zA-Z_]+)(?P<uniq>[^\w/])(?P<re>.+?)(?P=uniq)', r'(?P<\1>\g<re>)', route)
-    route = re.sub(r':([a-zA-Z_]+)', r'(?P<\1>[^/]+)', route)
-    return re.compile('^/%s$' % route)
+    # one pass, the inserted regexes are never read as wildcards
+    return _WILDCARDS.sub(_wildcard_regex, route)
+
+
+# ':name<converter>', ':name#regex#' with any non-word delimiter, ':name'
+_WILDCARDS = re.compile(r':(?P<name>[a-zA-Z_]+)(?:<(?P<conv>[a-zA-Z_]+)>|'
+                        r'(?P<uniq>[^\w/])(?P<re>.+?)(?P=uniq))?')
+
+
+def _wildcard_regex(match):
+    name, converter, regex = match.group('name', 'conv', 're')
+    if converter is not None:
+        if converter not in ROUTE_CONVERTERS:
+            raise SwinfError("Unknown route converter: %s" % converter)
+        regex = ROUTE_CONVERTERS[converter][0]
+    elif regex is None:
+        regex = '[^/]+'
+    return '(?P<%s>%s)' % (name, regex)
+
+
+def route_converters(route):
+    """ Returns {param name: conversion func} of the converters 
+        used in a route, or None if there is no conversion. """
+    converters = {}
+    for m in _WILDCARDS.finditer(route):
+        func = ROUTE_CONVERTERS.get(m.group('conv'), (None, None))[1]
+        if func:
+            converters[m.group('name')] = func
+    return converters or None
+
+
+def convert_params(params, converters):
+    """ Converts matched params in place. Returns False if a 
+        conversion fails, the route then does not match. """
+    for name, func in converters.iteritems():
+        try:
+            params[name] = func(params[name])
+        except (ValueError, TypeError, OverflowError):
+            return False
+    return True
+
+
+def add_converter(name, regex, func=None):
+    """ Adds a route converter usable as ':param<name>'.
+
+        `regex` matches the raw text and `func` converts it, 
+        raising ValueError if the text is invalid.
+
+        Example:
+            add_converter('hex', r'[0-9a-f]+', lambda x: int(x, 16))
+            @route('/color/:rgb<hex>')
+            def color(rgb): ... """
+    ROUTE_CONVERTERS[name] = (regex, func)
+
+
+# ------------------ route tree ------------------------------
+# Regex routes are also indexed by path segment, so a lookup only
+# walks the branches that can match the requested path instead of
+# trying every pattern in ROUTES_REGEXP.
+#
+#   /user/:id/edit      root -> 'user' -> (?P<id>[^/]+) -> 'edit'
+#   /user/:id#[0-9]+#   root -> 'user' -> (?P<id>[0-9]+)
+#
+# Every route keeps its insertion index, and the lowest index among
+# the matching leaves wins, which is exactly the first match of the
+# old linear scan. Routes that cannot be split into independent
+# segments (a wildcard regex that may match '/', like ':path#.+#')
+# are kept in a short fallback list and tried in the same order.
+
+_WILDCARD = re.compile(r'^:([a-zA-Z_]+)$')
+_SAFE_CATEGORIES = (sre_constants.CATEGORY_DIGIT, 
+    sre_constants.CATEGORY_WORD, sre_constants.CATEGORY_SPACE)
+_SLASH = ord('/')
+
+
+def _segment_safe(pattern):
+    """ Whether a parsed regex can never consume a '/'. """
+    for op, av in pattern:
+        if op == sre_constants.LITERAL:
+            if av == _SLASH: return False
+        elif op == sre_constants.NOT_LITERAL:
+            if av != _SLASH: return False
+        elif op == sre_constants.IN:
+            if not _set_safe(av): return False
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if not _segment_safe(av[2]): return False
+        elif op == sre_constants.SUBPATTERN:
+            if not _segment_safe(av[-1]): return False
+        elif op == sre_constants.BRANCH:
+            for branch in av[1]:
+                if not _segment_safe(branch): return False
+        else:
+            # any, anchors, group references, assertions ...
+            return False
+    return True
+
+
+def _set_safe(items):
+    """ Whether a regex character set '[...]' excludes '/'. """
+    if items and items[0][0] == sre_constants.NEGATE:
+        return (sre_constants.LITERAL, _SLASH) in items
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            if av == _SLASH: return False
+        elif op == sre_constants.RANGE:
+            if av[0] <= _SLASH <= av[1]: return False
+        elif op == sre_constants.CATEGORY:
+            if av not in _SAFE_CATEGORIES: return False
+        else:
+            return False
+    return True
+
+
+def split_route(route):
+    """ Splits a route into segment matchers for the route tree.
+
+    Returns a list of items, one per path segment:
+        'text'                          : static segment
+        (':name', None, 'name')         : plain ':name' wildcard
+        (segment, regex, converters)    : any other regex segment
+    or None if the route can not be matched segment by segment. """
+    route = route.strip().lstrip('$^/').rstrip('$^')
+    for m in _WILDCARDS.finditer(route):
+        if m.group('re') and '/' in m.group('re'):
+            return None
+    segments = []
+    for part in route.split('/'):
+        wildcard = _WILDCARD.match(part)
+        if wildcard:
+            segments.append((part, None, wildcard.group(1)))
+            continue
+        source = _route_regex(part)
+        try:
+            pattern = sre_parse.parse(source)
+        except Exception:
+            return None
+        if not _segment_safe(pattern):
+            return None
+        if all(op == sre_constants.LITERAL and av < 128 for op, av in pattern):
+            segments.append(''.join(chr(av) for op, av in pattern))
+        else:
+            segments.append((part, re.compile('^%s$' % source), \
+                route_converters(part)))
+    return segments
+
+
+class RouteNode(object):
+    """ A node of the route tree, one level per path segment. """
+    def __init__(self):
+        # segment text -> RouteNode
+        self.static = {}
+        # [[segment, regex, name or converters, RouteNode], ...] 
+        self.dynamic = []
+        # (index, handler) of the route ending here
+        self.leaf = None
+        # lowest route index in this subtree, used for pruning
+        self.first = sys.maxint
+
+    def insert(self, segments, index, handler):
+        self.first = min(self.first, index)
+        if not segments:
+            if self.leaf is None:
+                self.leaf = (index, handler)
+            return
+        segment, segments = segments[0], segments[1:]
+        if isinstance(segment, tuple):
+            for entry in self.dynamic:
+                if entry[0] == segment[0]:
+                    child = entry[3]
+                    break
+            else:
+                child = RouteNode()
+                self.dynamic.append(list(segment) + [child])
+        else:
+            child = self.static.setdefault(segment, RouteNode())
+        child.insert(segments, index, handler)
+
+    def match(self, parts, depth, best):
+        """ Returns the best (index, handler, params) found in this
+            subtree, or `best` if there is no better one. """
+        if depth == len(parts):
+            if self.leaf and (best is None or self.leaf[0] < best[0]):
+                return (self.leaf[0], self.leaf[1], {})
+            return best
+        part = parts[depth]
+        child = self.static.get(part)
+        if child and (best is None or child.first < best[0]):
+            best = child.match(parts, depth + 1, best)
+        for key, regex, extra, child in self.dynamic:
+            if best is not None and child.first >= best[0]:
+                continue
+            if regex is None:
+                if not part: continue
+                params = {extra: part}
+            else:
+                m = regex.match(part)
+                if not m: continue
+                params = m.groupdict()
+                if extra and not convert_params(params, extra):
+                    continue
+            found = child.match(parts, depth + 1, best)
+            if found is not best:
+                found[2].update(params)
+                best = found
+        return best
+
+
+class RouteTree(object):
+    """ Segment tree of the regex routes of one request method. """
+    def __init__(self):
+        self.root = RouteNode()
+        # [(index, regex, handler, literal prefix, converters), ...] 
+        # routes out of the tree
+        self.fallback = []
+        # route strings and match counts, by index
+        self.routes = []
+        self.hits = []
+
+    def add(self, route, regex, handler):
+        index = len(self.routes)
+        self.routes.append(route)
+        self.hits.append(0)
+        segments = split_route(route)
+        if segments is None:
+            self.fallback.append((index, regex, handler, \
+                literal_prefix(regex), route_converters(route)))
+        else:
+            self.root.insert(segments, index, handler)
+
+    def match(self, url):
+        """ Returns the first matching handler and a parameter 
+            dict or (None, None)"""
+        best = self.root.match(url[1:].split('/'), 0, None)
+        fallback = self.fallback
+        for pos in xrange(len(fallback)):
+            index, regex, handler, prefix, converters = fallback[pos]
+            if best is not None and index > best[0]:
+                continue
+            match = regex.match(url)
+            if match:
+                params = match.groupdict()
+                if converters and not convert_params(params, converters):
+                    continue
+                if ADAPTIVE_ROUTES:
+                    self.hits[index] += 1
+                    self.promote(fallback, pos)
+                return (handler, params)
+        if best is None:
+            return (None, None)
+        if ADAPTIVE_ROUTES:
+            self.hits[best[0]] += 1
+        return (best[1], best[2])
+
+    def promote(self, fallback, pos):
+        """ Swaps the fallback route at `pos` with its predecessor
+            if it matched more often and the two routes can never 
+            match the same url, so the winner of every url stays 
+            the same. """
+        if pos == 0: return
+        prev, current = fallback[pos - 1], fallback[pos]
+        if self.hits[current[0]] <= self.hits[prev[0]]:
+            return
+        if prev[3].startswith(current[3]) or \
+                current[3].startswith(prev[3]):
+            return
+        # copy on write, a concurrent match keeps a consistent list
+        fallback = list(fallback)
+        fallback[pos - 1], fallback[pos] = current, prev
+        self.fallback = fallback
+
+
+def literal_prefix(regex):
+    """ Returns the literal text every match of `regex` starts 
+        with. Two routes whose prefixes are not a prefix of each 
+        other can never match the same url. """
+    if regex.flags & re.IGNORECASE:
+        return ''
+    prefix = []
+    for op, av in sre_parse.parse(regex.pattern):
+        if op == sre_constants.AT and not prefix:
+            continue
+        if op != sre_constants.LITERAL:
+            break
+        prefix.append(unichr(av))
+    return u''.join(prefix)
 
 
 def match_url(url, method = 'GET'):
     """ Returns the first matching handler and a parameter 
         dict or (None, None)"""
     url = '/' + url.strip().lstrip('/')
+    cache = ROUTE_CACHE
+    if cache is None:
+        return _match_url(url, method)
+    key = (method, url)
+    found = cache.get(key)
+    if found is None:
+        handler, args = _match_url(url, method)
+        # misses are cached too, as (None, None)
+        found = (handler, args if args is None else tuple(args.items()))
+        cache[key] = found
+    handler, args = found
+    return (handler, args if args is None else dict(args))
+
+
+def _match_url(url, method):
     # Static routes first
     route = ROUTES_SIMPLE.get(method, {}).get(url, None)
     if route:
         return (route, {})
     # Then regrex routes
-    routes = ROUTES_REGEXP.get(method, [])
-    for i in xrange(len(routes)):
-        match = routes[i][0].match(url)
-        if match:
-            handler = routes[i][1]
-            # TODO swap the frequently matching route with its predecessor
-            return (handler, match.groupdict())
+    tree = ROUTES_TREE.get(method)
+    if tree:
+        return tree.match(url)
     return (None, None)
 
 
-def add_route(route, handler, method='GET', simple=False):
+def enable_route_cache(maxsize=1024):
+    """ Caches the result of match_url for the `maxsize` most
+        recently requested (method, url), including urls that 
+        match no route. The cache is cleared whenever the route 
+        tables change. Returns the LRUCache, whose hits and 
+        misses can be read with `info()`.
+        
+        Example:
+            cache = enable_route_cache(4096)
+            ...
+            cache.info()    # {'hits': 10, 'misses': 2, ...}"""
+    global ROUTE_CACHE
+    ROUTE_CACHE = LRUCache(maxsize)
+    return ROUTE_CACHE
+
+
+def disable_route_cache():
+    global ROUTE_CACHE
+    ROUTE_CACHE = None
+
+
+def clear_route_cache():
+    """ Drops all cached matches, called when routes are changed. """
+    if ROUTE_CACHE is not None:
+        ROUTE_CACHE.clear()
+
+
+def enable_adaptive_routes(enable=True):
+    """ Counts how often each regex route matches and moves hot 
+        routes of the fallback list (routes the route tree can not 
+        split by segment) ahead of their predecessors, as long as 
+        the two can never match the same url.
+
+        With the route cache enabled only cache misses are counted. """
+    global ADAPTIVE_ROUTES
+    ADAPTIVE_ROUTES = bool(enable)
+
+
+def route_hits(method='GET'):
+    """ Returns [(route, hits), ...] of the regex routes of 
+        `method`, most matched first. 
+
+        Example:
+            enable_adaptive_routes()
+            ...
+            route_hits('GET')   # [('/user/:id', 120), ...] """
+    tree = ROUTES_TREE.get(method.strip().upper())
+    if not tree:
+        return []
+    return sorted(zip(tree.routes, tree.hits), key=lambda x: -x[1])
+
+
+def add_route(route, handler, method='GET', simple=False, cache=None):
     """ Adds a new route to the route mappings.
+
+        `cache` caches the responses like the cached() decorator, 
+        it is a ttl in seconds or a dict of cached() arguments.
         
         Example:
         def hello(): return 'hello world'
-        add_route(r'/hello', hello)"""
+        add_route(r'/hello', hello)
+        add_route(r'/news', news, cache={'ttl': 30, 'vary': ['page']})"""
+    mark_registration()
+    if cache is not None:
+        if isinstance(cache, dict):
+            handler = cached(**cache)(handler)
+        else:
+            handler = cached(cache)(handler)
     method = method.strip().upper()
     if re.match(r'^/(\w+/)*\w*$', route) or simple:
         ROUTES_SIMPLE.setdefault(method, {})[route] = handler
     else:
-        route = compile_route(route)
-        ROUTES_REGEXP.setdefault(method, []).append([route, \
+        regex = compile_route(route)
+        ROUTES_REGEXP.setdefault(method, []).append([regex, \
             handler])
+        ROUTES_TREE.setdefault(method, RouteTree()).add(route, \
+            regex, handler)
+    clear_route_cache()
 
 
 def route(url, **kargs):
@@ -74,7 +468,8 @@ def route(url, **kargs):
 __handlespace__ = None
 
 
-def handler_walk(control_dir = "controller/", skip_prefix=True):
+def handler_walk(control_dir = "controller/", skip_prefix=True, \
+        manifest=None):
     """ Tranverse the 'controller/' dir and merge handlers 
         from each module.  
         
@@ -91,52 +486,186 @@ def handler_walk(control_dir = "controller/", skip_prefix=True):
             #   "control.a",
             #   "control.b",
             # )
+
+        If `manifest` is a file path, the discovered routes are 
+        written to it. Later boots load the routes from the 
+        manifest while no controller file changed, and a 
+        controller module is only imported by the first request 
+        that hits one of its handlers. Modules that add routes, 
+        error handlers or handler hooks when imported are still 
+        imported at startup; anything else a module does on import 
+        waits for that first request.
     """
-    import os
-
-    handle_modules = []
-
-    def add_handle_modules(control_dir):
-        """ Scan modules and get module paths containing 
-        valid handlers.  """
-        objects = os.walk(control_dir)
-        # current dir
-        for obj in objects:
-            # TODO inter add abs path
-            if obj[2] and "__init__.py" in obj[2]:
-                module_files = [ f[:-3] for f in obj[2] if \
-                    f.endswith(".py") ]
-                module_paths = [os.path.join(obj[0], f) \
-                        for f in module_files ]
-                module_strs = [f.replace('/', '.') \
-                        for f in module_paths]
-                handle_modules.extend(module_strs)
-                # Nested walking 
-                if obj[1]:
-                    for dirpath in obj[1]:
-                        add_handle_modules( os.path.join\
-                                (control_dir, dirpath))
-
-    add_handle_modules(control_dir)
-    join_handler_space(*handle_modules)
-    
-    prefix = "/" + control_dir
-
-    if skip_prefix:
-        print "skip prefix"
-        for method in ROUTES_SIMPLE:
-            for route in ROUTES_SIMPLE[method]:
-                print "prefix: %s, route: %s : " % \
-                        (prefix, route)
-                if route.startswith(prefix):
-                    handler = ROUTES_SIMPLE[method][route]
-                    del ROUTES_SIMPLE[method][route]
-                    route = route.replace(prefix, "/")
-                    ROUTES_SIMPLE[method].setdefault\
-                            (route, handler)
+    control_dir = os.path.normpath(control_dir)
+    prefix = "/" + control_dir.replace(os.sep, "/") + "/"
+    table = manifest and load_route_manifest(manifest, control_dir, \
+            skip_prefix)
+    if table:
+        for path in table['eager']:
+            importlib.import_module(path)
+        for method, route, path, attr in table['handlers']:
+            add_route(route, LazyHandler(path, attr), method, \
+                    simple=True)
+    else:
+        eager, handlers = [], []
+        for path in controller_modules(control_dir):
+            for method, route, attr in _handler_space_routes(path, eager):
+                if skip_prefix and route.startswith(prefix):
+                    route = route.replace(prefix, "/", 1)
+                handlers.append((method, route, path, attr))
+        for method, route, path, attr in handlers:
+            handler = getattr(sys.modules[path], attr)
+            add_route(route, handler, method, simple=True)
+        if manifest:
+            dump_route_manifest(manifest, control_dir, skip_prefix, \
+                    eager, handlers)
+    clear_route_cache()
+
+
+def controller_modules(control_dir):
+    """ Returns module paths of the python files in the packages 
+        of `control_dir`, like ['controller.greet', ...]. """
+    modules = []
+    for dirpath, dirnames, filenames in os.walk(control_dir):
+        if "__init__.py" not in filenames:
+            del dirnames[:]
+            continue
+        dirnames.sort()
+        package = os.path.normpath(dirpath).replace(os.sep, '.')
+        modules.extend(["%s.%s" % (package, f[:-3]) for f in \
+            sorted(filenames) if f.endswith(".py")])
+    return modules
 
+
+def _handler_space_routes(path, eager=None):
+    """ Imports a module and yields (method, route, attr) for each
+        handler in its __handlespace__. 
         
-    
+        Modules that add routes, error handlers or handler hooks 
+        themselves while imported (e.g. by @route or @error) are 
+        appended to `eager`. """
+    global _REGISTERED
+    _REGISTERED = False
+    module = importlib.import_module(path.strip())
+    if _REGISTERED and eager is not None:
+        eager.append(module.__name__)
+    handle_space = getattr(module, '__handlespace__', None)
+    if not handle_space:
+        return
+    for method in handle_space:
+        for attr in sorted(handle_space[method]):
+            route = '/' + ("%s.%s" % (module.__name__, attr)).replace(".", "/")
+            yield (method, route, attr)
+
+
+# set by add_route, error() and handler_hooks, to find the modules
+# that register something on import
+_REGISTERED = False
+
+def mark_registration():
+    """ Notes that a route, an error handler or a handler hook was
+        registered, so handler_walk imports the controller module
+        that did it at startup even with a route manifest. """
+    global _REGISTERED
+    _REGISTERED = True
+
+
+class LazyHandler(object):
+    """ Handler of a route manifest which imports its controller 
+        module on the first call. """
+    def __init__(self, module, attr):
+        self.module, self.attr = module, attr
+        self.handler = None
+
+    def load(self):
+        if self.handler is None:
+            module = importlib.import_module(self.module)
+            self.handler = getattr(module, self.attr)
+        return self.handler
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # attributes of the handler, like cache_policy
+        if name == 'handler':
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return '<LazyHandler %s.%s>' % (self.module, self.attr)
+
+
+def _file_signature(filename):
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    return [os.path.getmtime(filename), digest]
+
+
+def _controller_files(control_dir):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(control_dir):
+        if "__init__.py" not in filenames:
+            del dirnames[:]
+            continue
+        files.extend([os.path.join(dirpath, f) for f in filenames \
+                if f.endswith(".py")])
+    return files
+
+
+def load_route_manifest(manifest, control_dir, skip_prefix=True):
+    """ Returns the route table of a manifest written by 
+        handler_walk, or None if it is missing or out of date. 
+        
+        A controller file is unchanged if its mtime, or else its 
+        sha1 hash, equals the one in the manifest. """
+    try:
+        with open(manifest, 'rb') as f:
+            table = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if table.get('version') != MANIFEST_VERSION or \
+            table.get('control_dir') != control_dir or \
+            table.get('skip_prefix') != bool(skip_prefix):
+        return None
+    files = table.get('files', {})
+    current = _controller_files(control_dir)
+    if len(current) != len(files):
+        return None
+    for filename in current:
+        if filename not in files:
+            return None
+        try:
+            if os.path.getmtime(filename) == files[filename][0]:
+                continue
+            if _file_signature(filename)[1] != files[filename][1]:
+                return None
+        except OSError:
+            return None
+    return table
+
+
+def dump_route_manifest(manifest, control_dir, skip_prefix, eager, \
+        handlers):
+    """ Writes the route table discovered by handler_walk. """
+    table = {
+        'version': MANIFEST_VERSION,
+        'control_dir': control_dir,
+        'skip_prefix': bool(skip_prefix),
+        'files': dict([(f, _file_signature(f)) for f in \
+            _controller_files(control_dir)]),
+        'eager': eager,
+        'handlers': handlers,
+    }
+    # write and rename, other workers never read half a file
+    tmp = '%s.%d.tmp' % (manifest, os.getpid())
+    with open(tmp, 'wb') as f:
+        json.dump(table, f, indent=1)
+    os.rename(tmp, manifest)
+
+
+MANIFEST_VERSION = 2
+
 
 def join_handler_space(*module_paths):
     """ Given handler's module and automatically 
@@ -154,26 +683,9 @@ def join_handler_space(*module_paths):
     to routes
     """
     for path in module_paths:
-        path = path.strip()
-        # TODO use regrex to verify the reliability of path
-        print 'import path: ', path
-        exec "import %s" % path
-        #print 'client_module', client_module
-        try:
-            exec "handle_space = %s.__handlespace__" % path
-            #client_module = __import__(path)
-            global __handlespace__
-            __handlespace__ = handle_space
-            #handle_space = client_module.__handlespace__
-        except:
-            print ".. tranverse controller >> skip module: %s" % path
-            continue
-        for method in __handlespace__:
-            for handler in __handlespace__[method]:
-                handler_str = "%s.%s " % (path, handler)
-                route = '/' + handler_str.replace(".", "/").strip()
-                exec "handler  = %s" % handler_str
-                add_route(route, handler, method, simple=True)
+        for method, route, attr in _handler_space_routes(path):
+            handler = getattr(sys.modules[path.strip()], attr)
+            add_route(route, handler, method, simple=True)
 
 
 def handler(method="GET"):
@@ -38,8 +38,13 @@ class BaseCommand(object):
         (options, args) = parser.parse_args(args[1:])
         try:
             self.execute(*args, **options.__dict__)
+        except CommandError, e:
+            sys.stderr.write('Error: %s\n' % e)
+            sys.exit(1)
         except Exception, e:
             parser.print_usage()
+            sys.stderr.write('Error: %s: %s\n' % (e.__class__.__name__, e))
+            sys.exit(1)
 
     def execute(self, *args, **options):
         raise NotImplementedError()
@@ -0,0 +1,87 @@
+import os
+import sys
+from optparse import make_option
+from swinf import config, TemplateError, TemplateSyntaxError
+from swinf.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Compiles the templates of config.template.lookup into the " \
+           "bytecode cache, so the workers of a deploy load them instead " \
+           "of compiling them on their first requests. Exits with status 1 " \
+           "if a template does not compile."
+    args = ''
+    option_list = (
+        make_option('-s', '--settings', default='settings',
+            help='settings module of the project, imported from the current '
+                 'directory [default: %default]'),
+        make_option('-o', '--output', default=None,
+            help='bytecode cache directory, config.template.bytecode_cache '
+                 'by default'),
+        make_option('--stream', action='store_true', default=False,
+            help='compile the code of stream_template() as well'),
+    )
+
+    def execute(self, *args, **options):
+        self.load_settings(options.get('settings') or 'settings')
+        if options.get('output'):
+            config.template.bytecode_cache = options['output']
+        if not config.template.bytecode_cache:
+            raise CommandError("No bytecode cache directory, set "
+                "config.template.bytecode_cache or use --output")
+        # the template classes read config.template when imported
+        from swinf.template import SimpleTemplate, normalize_extensions
+        lookup = config.template.lookup
+        extensions = [ext for ext in \
+                normalize_extensions(config.template.extensions) if ext]
+
+        count, errors = 0, 0
+        for filename in self.find_templates(lookup, extensions):
+            name = os.path.relpath(filename)
+            try:
+                tpl = SimpleTemplate(path=filename, lookup=lookup)
+                tpl.compile
+                if options.get('stream'):
+                    tpl.compile_stream
+            except TemplateSyntaxError, e:
+                errors += 1
+                sys.stderr.write('%s\n' % e)
+            except TemplateError, e:
+                errors += 1
+                sys.stderr.write('%s: %s\n' % (name, e))
+            except (UnicodeDecodeError, TypeError, ValueError), e:
+                # undecodable source, null bytes
+                errors += 1
+                sys.stderr.write('%s: %s: %s\n' % \
+                        (name, e.__class__.__name__, e))
+            else:
+                count += 1
+        print 'compiled %d templates into %s, %d errors' % \
+                (count, os.path.abspath(config.template.bytecode_cache), errors)
+        if errors:
+            sys.exit(1)
+
+    def load_settings(self, module):
+        sys.path.insert(0, os.getcwd())
+        try:
+            __import__(module)
+        except ImportError, e:
+            if module != 'settings':
+                raise CommandError("Could not import settings %s: %s" % \
+                        (module, e))
+            sys.stderr.write("No settings module, using the defaults\n")
+
+    def find_templates(self, lookup, extensions):
+        """ Absolute paths of the files with a template extension in the
+        `lookup` directories, once each. """
+        found, seen = [], set()
+        for _dir in lookup:
+            for dirpath, dirnames, filenames in os.walk(_dir):
+                dirnames.sort()
+                for basename in sorted(filenames):
+                    filename = os.path.abspath(os.path.join(dirpath, basename))
+                    if filename not in seen and \
+                            os.path.splitext(basename)[1] in extensions:
+                        seen.add(filename)
+                        found.append(filename)
+        return found
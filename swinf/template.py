@@ -3,16 +3,30 @@ __all__ = (
     # container of user-defined extension method to SimpleTemplate
     "extens", 
     "SimpleTemplate",
+    "BytecodeCache",
+    "TemplateIndex",
     "template",
+    "stream_template",
+    "invalidate_fragments",
 )
 
 import re
 import os
+import ast
+import imp
+import time
+import hashlib
+import marshal
+import opcode
+import tempfile
+import warnings
+from threading import Lock
 import swinf
-from swinf import TemplateError, config
-from swinf.utils import MyBuffer
+from swinf import TemplateError, TemplateSyntaxError, config
+from swinf.utils import LRUCache, MyBuffer, StreamBuffer
+from swinf.utils.cache import MemoryCache
 from swinf.utils.functional import cached_property
-from swinf.utils.html import html_escape
+from swinf.utils.html import Markup, html_escape
 from swinf.utils.text import touni
 
 class BaseTemplate:
@@ -35,27 +49,55 @@ class BaseTemplate:
         self.settings = self.settings.copy()
         self.settings.update(settings)
         if lookup: self.lookup = lookup
+        # files the compiled code is made of, filename -> (mtime, size)
+        self.dependencies = {}
+        self.checked = time.time()
         # search template file 
         if not self.source:
             if not path: raise TemplateError("No template specified.")
             self.filename = self.search(path, self.lookup)
             if not self.filename:
                 raise TemplateError("Template %s not found" % repr(path))
+            self.source = self.read(self.filename)
+        self.prepare(**self.settings)
+
+    def read(self, filename):
+        """ Returns the source of a template file and records its
+        mtime and size in dependencies. """
+        try:
+            with open(filename, 'r') as f:
+                source = f.read()
+                stats = os.fstat(f.fileno())
+                self.dependencies[filename] = (stats.st_mtime, stats.st_size)
+        except IOError:
+            raise TemplateError("Template load IO Error")
+        return source
+
+    def is_fresh(self, interval=0):
+        """ Whether the files of the template are unchanged. They are
+        stat()ed at most every `interval` seconds, never if it is None. """
+        if interval is None or not self.dependencies:
+            return True
+        now = time.time()
+        if now - self.checked < interval:
+            return True
+        self.checked = now
+        for filename, stamp in self.dependencies.iteritems():
             try:
-                with open(self.filename, 'r') as f:
-                    self.source = f.read()
-            except IOError:
-                raise TemplateError("Template load IO Error")
-        self.prepare(settings)
+                stats = os.stat(filename)
+                if (stats.st_mtime, stats.st_size) != stamp:
+                    return False
+            except OSError:
+                return False
+        return True
 
     @classmethod
     def search(cls, name, lookup=[]):
-        for _dir in lookup:
-            filename = os.path.join(_dir, name)
-            print 'search template in ', filename
-            for extension in cls.extensions:
-                if os.path.isfile(filename + extension):
-                    return filename + extension
+        """ The file of template `name` in the `lookup` directories, 
+        None if there is none. """
+        if os.path.isabs(name) or name.startswith('..'):
+            return search_files(name, lookup, cls.extensions)
+        return template_index(lookup, cls.extensions).find(name)
 
     def prepare(self, **options):
         raise NotImplementedError
@@ -85,7 +127,15 @@ class Codit(object):
         self.stack = []
         self.ptrbuffer = []
         self.codebuffer = []
+        # numbers of the open {% cache %} blocks
+        self.cache_blocks = []
+        self.cache_count = 0
         self.multiline = self.dedent = self.oneline = False
+        self.streaming = False
+        # template line of each line of codebuffer
+        self.linemap = []
+        self.lineno = self.textline = 0
+        self.lock = Lock()
 
     def __call__(self, tempalte):
         """
@@ -95,7 +145,7 @@ class Codit(object):
         return self.run(template)
 
     def yield_tokens(self, line):
-        for i, part in enumerate(re.split(r'\{\{(.*?)\}\}', line)):
+        for i, part in enumerate(_TOKENS.split(line)):
             if i % 2:
                 if part.startswith('!'): yield 'RAW', part[1:]
                 else: yield 'CMD', part
@@ -104,25 +154,61 @@ class Codit(object):
     def code(self, stmt):
         for line in stmt.splitlines():
             self.codebuffer.append(self.indent_space * len(self.stack) + line.strip())
+            self.linemap.append(self.lineno)
 
 
     def flush(self):
+        """ Emits the text lines buffered since the last code line as 
+        one statement: adjacent text merged into one constant, empty 
+        text dropped, a single item appended without a list. """
         if not self.ptrbuffer: return
-        cline = ''
-        for line in self.ptrbuffer:
+        self.lineno = self.textline
+        # text as unicode, code as (function, expression)
+        items, lines = [], []
+        for lineno, line in self.ptrbuffer:
             for token, value in line:
                 if not value: continue
-                if token == 'TXT': cline += repr(value) # add '
-                elif token == 'RAW': cline += '_str(%s)' % value
-                elif token == 'CMD': cline += '_escape(%s)' % value
-                cline += ', '
-            cline = cline[:-2] + '\\\n'
-        cline = cline[:-2]
-        if cline[:-1].endswith('\\\\\\\\\\n'):
-            cline = cline[:-7] + cline[-1] # 'nobr\\\\\n' --> 'nobr'
-        cline = '_printlist([' + cline + '])'
+                if token == 'TXT':
+                    if items and isinstance(items[-1], unicode):
+                        items[-1] += value
+                        continue
+                    items.append(value)
+                elif token == 'RAW': items.append(('_str', value))
+                elif token == 'CMD': items.append(('_escape', value))
+                lines.append(lineno)
         del self.ptrbuffer[:]
-        self.code(cline)
+        if items and isinstance(items[-1], unicode) and \
+                items[-1].endswith('\\\\\n'):
+            items[-1] = items[-1][:-3] # 'nobr\\\n' --> 'nobr'
+            if not items[-1]:
+                items.pop()
+                lines.pop()
+        if not items:
+            # the lines may be the only ones of a block
+            self.code('pass')
+            return
+        exprs = [repr(item) if isinstance(item, unicode) else '%s(%s)' % item \
+                for item in items]
+        if len(exprs) == 1:
+            self.lineno = lines[0]
+            self.code('_append(%s)' % exprs[0])
+        else:
+            # an item per line, at the template line it comes from
+            exprs = [expr + ',' for expr in exprs]
+            exprs[0] = '_printlist([' + exprs[0]
+            exprs[-1] = exprs[-1][:-1] + '])'
+            for expr, lineno in zip(exprs, lines):
+                self.lineno = lineno
+                self.code(expr)
+        if self.streamable():
+            self.code('if _stdout.length >= _chunk_size: yield _stdout.take()')
+
+    def streamable(self):
+        """ Whether the code may yield a chunk here: in stream mode, 
+        outside of {% cache %} blocks and of functions and classes 
+        defined by the template. """
+        return self.streaming and not self.cache_blocks and \
+                'def' not in self.stack and 'class' not in self.stack
 
     # TODO add an option to clean empty string line 
     def codit(self):
@@ -153,6 +239,7 @@ class Codit(object):
                 #if not line: continue
                 cmd = re.split(r'[^a-zA-Z0-9_]', line)[0]
                 self.flush()
+                self.lineno = lineno + 1
 
                 if cmd in self.blocks or self.multiline:
                     cmd = self.multiline or cmd
@@ -165,20 +252,175 @@ class Codit(object):
                     multiline = cmd if line.endswith('\\') else False
                     if not oneline and not multiline:
                         self.stack.append(cmd)
+                elif cmd == 'cache':
+                    self.cache_begin(line.strip()[5:].strip())
+                elif cmd == 'endcache' and self.cache_blocks:
+                    self.cache_end()
                 elif cmd.startswith('end') and self.stack:
                     self.code('#end(%s) %s' % (self.stack.pop(), line.strip()[3:]))
+                elif cmd == '_include' and self.streamable():
+                    # stream the subtemplate chunk by chunk too
+                    self.code('for _chunk in _include_stream%s: yield _chunk' \
+                            % line.strip()[8:])
                 else:
                     self.code(line)
             else:
-                self.ptrbuffer.append(self.yield_tokens(line))
+                if not self.ptrbuffer:
+                    self.textline = lineno + 1
+                self.ptrbuffer.append((lineno + 1, self.yield_tokens(line)))
         self.flush()
         return '\n' .join(self.codebuffer) + '\n' 
+
+    def codit_stream(self):
+        """
+        Parse template to python code buffer, yielding the output in 
+        chunks while it runs, for the body of a generator function.
+        """
+        self.streaming = True
+        try:
+            return self.codit()
+        finally:
+            self.streaming = False
+
+    def function_code(self, name, body, names=(), stream=False):
+        """
+        Wraps the code of codit() into a function `name`. The helpers
+        of _LOCALS become fast locals, and `names`, the names assigned 
+        by the template, are declared global so its variables behave 
+        as in module level code.
+        """
+        indent = self.indent_space
+        lines = ['def %s(%s):' % (name, \
+                ', '.join(['%s=%s' % (local, local) for local in _LOCALS]))]
+        names = [n for n in names if n not in _LOCALS]
+        if names:
+            lines.append(indent + 'global ' + ', '.join(names))
+        lines.extend([indent + line for line in body.splitlines()])
+        if stream:
+            lines.append(indent + 'if _stdout: yield _stdout.take()')
+        else:
+            lines.append(indent + 'pass')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        self.stack, self.ptrbuffer, self.codebuffer = [], [], []
+        self.linemap, self.lineno, self.textline = [], 0, 0
+        self.cache_blocks, self.cache_count = [], 0
+        self.multiline = self.dedent = self.oneline = False
     
+    def cache_begin(self, args):
+        """ {% cache 'name', key, ttl=300 %}: a hit of the fragment 
+        cache is appended to _stdout, else the block runs and its 
+        output is stored at {% endcache %}. """
+        self.cache_count += 1
+        n = self.cache_count
+        self.cache_blocks.append(n)
+        self.code('_ck%d, _ct%d, _cf%d = _cache_fragment(%s)' % (n, n, n, args))
+        self.code('if _cf%d is not None:' % n)
+        self.stack.append('cache')
+        self.code('_stdout.append(_cf%d)' % n)
+        self.stack.pop()
+        self.code('else:')
+        self.stack.append('cache')
+        self.code('_cm%d = len(_stdout)' % n)
+
+    def cache_end(self):
+        n = self.cache_blocks.pop()
+        self.code('_cache_store(_ck%d, _ct%d, _stdout, _cm%d)' % (n, n, n))
+        self.stack.pop()
+
     @cached_property
     def compile(self):
-        code = self.codit()
+        return self._compile(stream=False)
+
+    @cached_property
+    def compile_stream(self):
+        """ Code defining the `_stream` generator of stream mode. """
+        return self._compile(stream=True)
+
+    def _compile(self, stream):
+        # the parser state is shared, compile once in one thread
+        with self.lock:
+            co = self.__dict__.get('compile_stream' if stream else 'compile')
+            if co is None:
+                co = self._compile_code(stream)
+            return co
+
+    def _compile_code(self, stream):
+        filename = getattr(self, 'filename', None)
+        cache = bytecode_cache()
+        if cache is not None:
+            key = cache.key(self, filename, stream)
+            stamps = cache.stamps(getattr(self, 'dependencies', {}), \
+                    getattr(self, 'lookup', ()))
+            co = cache.load(key, stamps, self.template)
+            if co is not None:
+                return co
+        name = filename or '<string>'
+        if filename and self.template is not getattr(self, 'source', None):
+            # flattened from a layout, its lines are of no single file
+            name = '<template %s>' % filename
+        self.reset()
+        body = self.codit()
+        try:
+            module = self.compile_code(body, name)
+        except SyntaxError, e:
+            raise self.syntax_error(e, name)
+        names = stored_names(module)
+        if stream:
+            self.reset()
+            body = self.codit_stream()
+            co = self.compile_code(self.function_code('_stream', body, \
+                    names, stream=True), name, body)
+        else:
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error', SyntaxWarning)
+                    co = self.compile_code(self.function_code('_render', \
+                            body, names), name, body)
+            except SyntaxError:
+                # e.g. 'import *', which only module level code allows
+                co = module
         self.__clean()
-        return compile(code, '<string>', 'exec')
+        if cache is not None:
+            cache.dump(key, stamps, self.template, co)
+        return co
+
+    def compile_code(self, source, name, body=None):
+        """ Compiles `source`, the code of codit() or a function_code()
+        of its `body`, with the line numbers of the template. """
+        tree = compile(source, name, 'exec', ast.PyCF_ONLY_AST)
+        size = len(source.splitlines())
+        # lines of function_code() before the body
+        offset = size - len(body.splitlines()) - 1 if body else 0
+        # kept ascending, as the line table of a code object needs
+        lines, last = [], 1
+        for n in xrange(size):
+            if 0 <= n - offset < len(self.linemap):
+                last = max(last, self.linemap[n - offset])
+            lines.append(last)
+        for node in ast.walk(tree):
+            if hasattr(node, 'lineno'):
+                node.lineno = lines[min(node.lineno, size) - 1]
+        return compile(tree, name, 'exec')
+
+    def syntax_error(self, e, name):
+        """ The TemplateSyntaxError of a SyntaxError `e` of the code of
+        codit(), at the template line the code came from. """
+        lineno = None
+        if e.lineno and self.linemap:
+            index = min(e.lineno, len(self.linemap)) - 1
+            lineno = self.linemap[index]
+            # text lines are merged, find the {{expression}} at fault
+            lines = touni(self.template, self.encoding).splitlines()
+            end = self.linemap[index + 1] if index + 1 < len(self.linemap) \
+                    else len(lines)
+            for n in range(lineno, min(end, len(lines)) + 1):
+                if not expressions_compile(lines[n - 1]):
+                    lineno = n
+                    break
+        return TemplateSyntaxError("%s in template %s line %s" % \
+                (e.msg, name, lineno), name, lineno)
 
     def __clean(self):
         """
@@ -190,6 +432,212 @@ class Codit(object):
                 self.codebuffer, self.template):
             del m
 
+# {{expression}} tokens of a text line
+_TOKENS = re.compile(r'\{\{(.*?)\}\}')
+# helpers a compiled template gets as fast locals
+_LOCALS = ('_escape', '_str', '_printlist', '_append')
+
+def expressions_compile(line):
+    """ Whether the {{expression}} tokens of a text line compile. """
+    for expr in _TOKENS.findall(line):
+        try:
+            compile(expr[1:] if expr.startswith('!') else expr, '', 'eval')
+        except SyntaxError:
+            return False
+    return True
+
+_STORE_OPS = frozenset([opcode.opmap['STORE_NAME'], opcode.opmap['DELETE_NAME']])
+
+def stored_names(co):
+    """ Names assigned or deleted by the module level code `co`. """
+    code, names = co.co_code, set()
+    i, size, extended = 0, len(code), 0
+    while i < size:
+        op = ord(code[i])
+        if op < opcode.HAVE_ARGUMENT:
+            i += 1
+            continue
+        arg = ord(code[i + 1]) + ord(code[i + 2]) * 256 + extended
+        extended = arg << 16 if op == opcode.EXTENDED_ARG else 0
+        if op in _STORE_OPS:
+            names.add(co.co_names[arg])
+        i += 3
+    return sorted(names)
+
+
+# ------------- template inheritance ----------------------------
+def _tag(pattern):
+    """ A line holding only `pattern` as %% or {% %} code. """
+    return re.compile(r'^(?:%s|%s)\s*%s\s*(?:%s)?$' % \
+            (re.escape(Codit.single_line_code), \
+            re.escape(Codit.multi_code_begin), pattern, \
+            re.escape(Codit.multi_code_end)))
+
+_BLOCK = _tag(r'block\s+(\w+)')
+_ENDBLOCK = _tag(r'endblock(?:\s+\w+)?')
+_EXTENDS = _tag(r'extends\s+([\'"])(.+?)\1')
+
+def parse_blocks(source):
+    """ Returns (nodes, name of the extended template or None). A node
+    is a line of `source` or a (name, nodes) block. """
+    root = []
+    stack = [root]
+    parent = None
+    for line in source.splitlines(True):
+        if 'block' in line or 'extends' in line:
+            sline = line.strip()
+            m = _BLOCK.match(sline)
+            if m:
+                block = (m.group(1), [])
+                stack[-1].append(block)
+                stack.append(block[1])
+                continue
+            if len(stack) > 1 and _ENDBLOCK.match(sline):
+                stack.pop()
+                continue
+            m = _EXTENDS.match(sline)
+            if m and len(stack) == 1 and parent is None:
+                parent = m.group(2)
+                continue
+        stack[-1].append(line)
+    if len(stack) > 1:
+        raise TemplateError("Missing endblock in template")
+    return root, parent
+
+def collect_blocks(nodes, blocks):
+    """ Maps the names of the blocks in `nodes` to the blocks, the 
+    first one of a name wins. """
+    for node in nodes:
+        if isinstance(node, tuple):
+            blocks.setdefault(node[0], node)
+            collect_blocks(node[1], blocks)
+    return blocks
+
+def override_blocks(nodes, blocks, active=()):
+    """ Replaces the blocks in `nodes` by those of the same name in 
+    `blocks`. """
+    result = []
+    for node in nodes:
+        if isinstance(node, tuple) and node[0] not in active:
+            name, children = blocks.get(node[0], node)
+            node = (name, override_blocks(children, blocks, active + (name,)))
+        result.append(node)
+    return result
+
+def join_blocks(nodes):
+    """ The source of `nodes` without the block tags. """
+    lines = []
+    for node in nodes:
+        if isinstance(node, tuple):
+            lines.append(join_blocks(node[1]))
+        else:
+            lines.append(node)
+    return ''.join(lines)
+
+
+def relative_name(filename, lookup):
+    """ `filename` relative to the first `lookup` directory holding it,
+    prefixed by the index of that directory. The absolute path if no 
+    directory does. """
+    path = os.path.realpath(filename)
+    for index, _dir in enumerate(lookup):
+        root = os.path.join(os.path.realpath(_dir), '')
+        if path.startswith(root):
+            return '%d:%s' % (index, path[len(root):].replace(os.sep, '/'))
+    return os.path.abspath(filename)
+
+
+class BytecodeCache(object):
+    """
+    Compiled templates marshalled to files in `directory`, so a new
+    process loads them instead of compiling them again.
+
+    A file is named by the template path relative to its lookup 
+    directory (or the source hash of an inline template), the swinf 
+    and Python versions and the delimiter settings of Codit, so a 
+    cache made in another checkout, e.g. by compiletemplates, is found
+    in the deployed one. It holds the mtimes and sizes of the template
+    files, its layouts included, and the hash of the flattened source.
+    The source hash decides, changed stamps of an unchanged source
+    are written back, so the file is not rewritten again.
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def key(self, codit, filename=None, stream=False):
+        name = relative_name(filename, getattr(codit, 'lookup', ())) \
+                if filename else \
+                hashlib.sha1(self.encode(codit.template)).hexdigest()
+        settings = (codit.blocks, codit.dedent_blocks, codit.single_line_code, \
+                codit.multi_code_begin, codit.multi_code_end, codit.indent_space)
+        return hashlib.sha1(repr((name, swinf.__version__, imp.get_magic(), \
+                settings, codit.encoding, stream))).hexdigest()
+
+    @staticmethod
+    def encode(source):
+        return source.encode('utf8') if isinstance(source, unicode) else source
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.tplc')
+
+    @staticmethod
+    def stamps(dependencies, lookup):
+        """ The (mtime, size) of the template files by relative name. """
+        return dict([(relative_name(filename, lookup), stamp) \
+                for filename, stamp in dependencies.iteritems()])
+
+    def load(self, key, stamps, source):
+        """ Returns the cached code object, None if it is missing 
+        or stale. `stamps` are those of the files the template was
+        read from. """
+        try:
+            with open(self.path(key), 'rb') as f:
+                stored, digest, co = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        # two lookup roots may hold templates of the same relative name,
+        # size and mtime, only the source tells them apart
+        if hashlib.sha1(self.encode(source)).hexdigest() != digest:
+            return None
+        if stamps and stored != stamps:
+            # touched or copied only
+            self.dump(key, stamps, source, co)
+        return co
+
+    def dump(self, key, stamps, source, co):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                marshal.dump((dict(stamps), \
+                    hashlib.sha1(self.encode(source)).hexdigest(), co), f)
+            os.rename(tmp, self.path(key))
+        except (IOError, OSError):
+            # the cache is an optimization only
+            pass
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.tplc'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+BYTECODE_CACHE = None
+
+def bytecode_cache():
+    """ The BytecodeCache in config.template.bytecode_cache, None 
+    if that is not set. """
+    global BYTECODE_CACHE
+    directory = config.template.bytecode_cache
+    if not directory:
+        return None
+    if BYTECODE_CACHE is None or BYTECODE_CACHE.directory != \
+            os.path.abspath(directory):
+        BYTECODE_CACHE = BytecodeCache(directory)
+    return BYTECODE_CACHE
+
 # ------------- SimpleTemplate ----------------------------------
 from swinf.core.middleware import HooksAdapter
 
@@ -239,11 +687,45 @@ extens = Extens()
 class SimpleTemplate(BaseTemplate, Codit):
     def __init__(self, source=None, path=None, lookup=[], encoding='utf8', **settings):
         BaseTemplate.__init__(self, source, path, lookup, encoding, **settings)
-        Codit.__init__(self, self.source, encoding)
+        Codit.__init__(self, self.inherit(self.source), encoding)
+
+    def inherit(self, source):
+        """
+        Flattens template inheritance into plain template source.
+
+        A page extends a layout and replaces its named blocks, the
+        other lines of the page are dropped. Layouts may extend other
+        layouts, their files become dependencies of the page.
+
+        usage:
+            %% extends 'base'
+            %% block title
+            News
+            %% endblock
+        """
+        if 'block' not in source and 'extends' not in source:
+            return source
+        return join_blocks(self.resolve(touni(source, self.encoding)))
+
+    def resolve(self, source, seen=()):
+        nodes, parent = parse_blocks(source)
+        if parent is None:
+            return nodes
+        if parent in seen:
+            raise TemplateError("Template %s extends itself" % repr(parent))
+        filename = self.search(parent, self.lookup)
+        if not filename:
+            raise TemplateError("Template %s not found" % repr(parent))
+        layout = self.resolve(touni(self.read(filename), self.encoding), \
+                seen + (parent,))
+        return override_blocks(layout, collect_blocks(nodes, {}))
 
     def prepare(self, noescape=False, escape_func=html_escape):
         self._str = lambda x: touni(x, self.encoding)
         self._escape = escape_func
+        if escape_func is html_escape and self.encoding != 'utf8':
+            # byte strings are decoded like the template source
+            self._escape = lambda x: html_escape(x, self.encoding)
         if noescape:
             self._str, self._escape = self._escape, self._str
 
@@ -251,75 +733,296 @@ class SimpleTemplate(BaseTemplate, Codit):
         for dictarg in args: kwargs.update(dictarg)
         stdout = MyBuffer()
         self.execute(stdout, kwargs)
-        return stdout.source
+        # html already, {{ }} of another template leaves it as it is
+        return Markup(stdout.source)
+
+    def stream(self, *args, **kwargs):
+        """ Renders the template as a generator of unicode chunks, 
+        each about config.template.stream_chunk_size characters and 
+        yielded while the template runs, included subtemplates too. 
+        A handler can return it as it is. """
+        for dictarg in args: kwargs.update(dictarg)
+        return self.execute_stream(StreamBuffer(), kwargs)
     
     def execute(self, _stdout, *args, **kwargs):
-        self._stdout = _stdout
         for dictarg in args: kwargs.update(dictarg)
+        env = self.environ(_stdout, kwargs)
+        eval(self.compile, env)
+        # defined unless the template compiled as module code only
+        render = env.pop('_render', None)
+        if render is not None:
+            render()
+        return env
+
+    def execute_stream(self, _stdout, *args, **kwargs):
+        """ Returns the generator running the template into `_stdout`,
+        a StreamBuffer, and yielding its chunks. """
+        for dictarg in args: kwargs.update(dictarg)
+        env = self.environ(_stdout, kwargs)
+        env['_chunk_size'] = config.template.stream_chunk_size
+        env['_include_stream'] = lambda path, *args, **kwargs: \
+                self.load_subtemplate(path).execute_stream(_stdout, *args, **kwargs)
+        eval(self.compile_stream, env)
+        return env['_stream']()
+
+    def environ(self, _stdout, kwargs):
+        """ The globals a template runs with. All state of a render is
+        in there, so a cached template can render in many threads. """
         env = self.defaults.copy()
         # TODO add more template function here
         env.update({'_stdout': _stdout,
             '_printlist': _stdout.extend,
+            '_append': _stdout.append,
             '_escape': self._escape,
             '_str': self._str,
-            '_include': self.subtemplate,
+            '_include': lambda path, *args, **kwargs: \
+                    self.subtemplate(_stdout, path, *args, **kwargs),
             '_print': self._str,
+            '_cache_fragment': cache_fragment,
+            '_cache_store': store_fragment,
         })
         # add extens
         global extens
         env.update(extens)
         env.update(kwargs)
-        eval(self.compile, env)
-        self.__clean()
         return env
 
-    def subtemplate(self, path, *args, **kwargs):
+    def load_subtemplate(self, path):
+        return get_template(path=path, lookup=self.lookup, \
+                adapter=self.__class__)
+
+    def subtemplate(self, _stdout, path, *args, **kwargs):
+        """ Runs the template `path` into `_stdout`, the buffer of the
+        including render. """
         for dictarg in args: kwargs.update(dictarg)
-        if path not in TEMPLATES:
-            TEMPLATES[path] = self.__class__(path=path, lookup=self.lookup)
-        return TEMPLATES[path].execute(self._stdout, **kwargs)
+        return self.load_subtemplate(path).execute(_stdout, **kwargs)
 
-    def __clean(self):
-        """
-        Clean env
 
-        the template instance will be cached
-        """
-        for m in (self.source):
-            del m
+def reload_interval():
+    """ Seconds between the mtime checks of a cached template, every 
+    render in debug mode. """
+    return 0 if config.debug else config.template.check_interval
+
+# ------------- template cache ----------------------------------
+def normalize_extensions(extensions):
+    """ Extensions with their leading dot, 'tpl' is '.tpl'. """
+    return tuple([ext if not ext or ext.startswith('.') else '.' + ext \
+            for ext in extensions])
+
+def search_files(name, lookup, extensions):
+    """ Looks for `name` with each of `extensions` in the `lookup` 
+    directories on disk. """
+    for _dir in lookup:
+        filename = os.path.join(_dir, name)
+        for extension in normalize_extensions(extensions):
+            if os.path.isfile(filename + extension):
+                return os.path.abspath(filename + extension)
+
+
+class TemplateIndex(object):
+    """
+    The template files in the `lookup` directories by name, the path 
+    relative to its directory with or without the extension. Earlier
+    directories and extensions win, like a search of the files.
+
+    The directories are walked once and again when one of them 
+    changed, that is checked on a miss. A hit only stat()s its own
+    file, every reload_interval() seconds, and walks them again if it
+    is gone; a file that shadows a found one is seen on the next walk.
+
+    Usage:
+        index = TemplateIndex(['./view'], ['', '.tpl'])
+        index.find('blog/post')     # '/abs/view/blog/post.tpl'
+    """
+    def __init__(self, lookup, extensions):
+        self.lookup = [os.path.abspath(_dir) for _dir in lookup]
+        self.extensions = normalize_extensions(extensions)
+        self.builds = 0
+        self.build()
+
+    def build(self):
+        names, mtimes = {}, {}
+        for root in reversed(self.lookup):
+            # name -> (rank of the extension, filename) in this root
+            found, seen = {}, set()
+            for dirpath, dirnames, filenames in os.walk(root, \
+                    followlinks=True):
+                # a symlink back to a parent would be walked forever
+                real = os.path.realpath(dirpath)
+                if real in seen:
+                    del dirnames[:]
+                    continue
+                seen.add(real)
+                mtimes[dirpath] = os.path.getmtime(dirpath)
+                for basename in filenames:
+                    filename = os.path.join(dirpath, basename)
+                    name = os.path.relpath(filename, root).replace(os.sep, '/')
+                    for rank, ext in enumerate(self.extensions):
+                        if not name.endswith(ext):
+                            continue
+                        key = name[:len(name) - len(ext)]
+                        if key not in found or found[key][0] > rank:
+                            found[key] = (rank, filename)
+            for key, (rank, filename) in found.iteritems():
+                names[key] = filename
+        self.names, self.mtimes = names, mtimes
+        self.checked = time.time()
+        self.builds += 1
+
+    def changed(self):
+        self.checked = time.time()
+        for dirpath, mtime in self.mtimes.iteritems():
+            try:
+                if os.path.getmtime(dirpath) != mtime:
+                    return True
+            except OSError:
+                return True
+        # a lookup directory made after the build
+        return len(self.mtimes) < len([_dir for _dir in self.lookup \
+                if os.path.isdir(_dir)])
+
+    def find(self, name):
+        name = os.path.normpath(name).replace(os.sep, '/')
+        filename = self.names.get(name)
+        if filename is None:
+            if self.changed():
+                self.build()
+                filename = self.names.get(name)
+            return filename
+        interval = reload_interval()
+        if interval is not None and time.time() - self.checked >= interval:
+            self.checked = time.time()
+            if not os.path.isfile(filename):
+                self.build()
+                filename = self.names.get(name)
+        return filename
+
+
+# TemplateIndex by lookup directories and extensions
+INDEXES = {}
+
+def template_index(lookup, extensions):
+    key = (tuple(lookup), tuple(extensions))
+    index = INDEXES.get(key)
+    if index is None:
+        index = INDEXES[key] = TemplateIndex(lookup, extensions)
+    return index
 
+def template_size(tpl):
+    """ Approximate bytes of a cached template by its sources. """
+    return len(tpl.source or '') + len(getattr(tpl, 'template', '') or '')
 
-# cache compiled templates
-TEMPLATES = {}
+# loaded templates, made from config.template on first use
+TEMPLATES = None
+
+def template_cache():
+    """ The LRUCache of loaded templates, its info() has the hits,
+    misses and evictions. """
+    global TEMPLATES
+    if TEMPLATES is None:
+        TEMPLATES = LRUCache(config.template.cache_max_entries, \
+                config.template.cache_max_bytes, template_size)
+    return TEMPLATES
+
+def get_template(source=None, path=None, lookup=[], adapter=None, settings={}):
+    """ The cached template of a file or a source, loaded anew if one
+    of its files changed. Files are cached by their absolute path, 
+    sources by their hash and lookup directories. """
+    adapter = adapter or SimpleTemplate
+    if path:
+        filename = adapter.search(path, lookup)
+        if not filename:
+            raise TemplateError("Template %s not found" % repr(path))
+        key = (adapter, filename)
+    else:
+        filename = None
+        key = (adapter, hashlib.sha1(BytecodeCache.encode(source)).hexdigest(), \
+                tuple(lookup))
+    if settings:
+        key += (tuple(sorted(settings.items())),)
+    cache = template_cache()
+    tpl = cache.get(key)
+    if tpl is None or not tpl.is_fresh(reload_interval()):
+        tpl = adapter(source=source, path=filename, lookup=lookup, **settings)
+        cache[key] = tpl
+    return tpl
+
+# ------------- fragment cache ----------------------------------
+# rendered {% cache %} blocks, made from config.template on first use
+FRAGMENTS = None
+
+def fragment_cache():
+    global FRAGMENTS
+    if FRAGMENTS is None:
+        FRAGMENTS = MemoryCache(config.template.fragment_max_entries, \
+                config.template.fragment_max_bytes)
+    return FRAGMENTS
+
+def cache_fragment(*key, **options):
+    """ Returns (key, ttl, cached fragment or None) of a 
+    {% cache %} block. """
+    ttl = options.pop('ttl', None)
+    if options:
+        raise TemplateError("Unknown cache options: %s" % ', '.join(options))
+    return key, ttl, fragment_cache().get(key)
+
+def store_fragment(key, ttl, _stdout, mark):
+    fragment = u''.join([touni(chunk) for chunk in _stdout[mark:]])
+    _stdout[mark:] = [fragment]
+    fragment_cache().set(key, fragment, ttl)
+
+def invalidate_fragments(*prefix):
+    """
+    Drops the cached fragments whose key starts with `prefix`, all 
+    of them if no prefix is given.
+
+    usage:
+        # {% cache 'sidebar', user.role, ttl=300 %}
+        invalidate_fragments('sidebar')             # every role
+        invalidate_fragments('sidebar', 'admin')    # one role
+    """
+    cache = fragment_cache()
+    size = len(prefix)
+    for key in cache.keys():
+        if key[:size] == prefix:
+            cache.delete(key)
 
 TEMPLATE_PATH = ['./view']
 from swinf import abort
 
-def template(*args, **kwargs):  
-    '''
-    Get a rendered template as a string iterator.
-    args[0]     : default to source 
-    name        : template filename
-    source      : template source
-    '''
+def load_template(args, kwargs):
+    """ The cached template of the arguments of template(), the 
+    lookup options are popped from `kwargs`. """
     source = args[0] if args else None
     path = kwargs.pop('path', None)
     if not (source or path):
         abort("No Template Specified")
     adapter = kwargs.pop('adapter', SimpleTemplate)
     lookup = kwargs.pop('lookup', TEMPLATE_PATH)
-    # TODO tplid can be abs path or source
-    tplid = (id(lookup), path or source)
-    # refresh template if DEBUG and load changes every time
-    if tplid not in TEMPLATES or swinf.config.debug:
-        settings = kwargs.pop('settings', {})
-        if isinstance(source, adapter):
-            TEMPLATES[tplid] = source
-            if settings: TEMPLATES[tplid].prepare(**settings)
-        else:
-            TEMPLATES[tplid] = adapter(source=source, path=path, lookup=lookup, **settings)
-    # TODO if not same settings , maybe different cache
-    if not TEMPLATES[tplid]:
-        abort(500, 'Template (%s) not found' % repr(path))
+    settings = kwargs.pop('settings', {})
     for dictarg in args[1:]: kwargs.update(dictarg)
-    return TEMPLATES[tplid].render(kwargs)
+    if isinstance(source, adapter):
+        if settings: source.prepare(**settings)
+        return source
+    return get_template(source, path, lookup, adapter, settings)
+
+def template(*args, **kwargs):  
+    '''
+    Get a rendered template as a string iterator.
+    args[0]     : default to source 
+    name        : template filename
+    source      : template source
+    '''
+    return load_template(args, kwargs).render(kwargs)
+
+def stream_template(*args, **kwargs):
+    '''
+    Same as template(), but returns a generator of chunks that renders
+    the template while the response is sent.
+
+    usage:
+        @route('/report')
+        def report():
+            return stream_template(path='report.tpl', rows=rows)
+    '''
+    return load_template(args, kwargs).stream(kwargs)
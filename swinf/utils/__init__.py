@@ -2,12 +2,22 @@
 # [ThreadedDict, Storage]
 
 __all__ = [
-    "MyBuffer",
+    "MyBuffer", "StreamBuffer", "LRUCache",
     "Storage", "ThreadDict",
+    "ContextVar", "ContextProxy",
 ]
 
 
-from threading import local as threadlocal
+from threading import local as threadlocal, Lock
+try:
+    # greenlets (gevent, eventlet) get a context each, and a
+    # thread without greenlets is its own main greenlet
+    from greenlet import getcurrent as get_ident
+except ImportError:
+    try:
+        from thread import get_ident
+    except ImportError:
+        from dummy_thread import get_ident
 
 class MyBuffer(list):
     def write(self, strr):
@@ -20,7 +30,142 @@ class MyBuffer(list):
         pass
     @property
     def source(self):
-        return '\n'.join(self)
+        return ''.join(self)
+
+
+class StreamBuffer(MyBuffer):
+    """ A MyBuffer counting the characters written to it, which are
+    taken out chunk by chunk by a streaming template. """
+    def __init__(self):
+        list.__init__(self)
+        self.length = 0
+
+    def append(self, chunk):
+        list.append(self, chunk)
+        self.length += len(chunk)
+
+    def extend(self, chunks):
+        list.extend(self, chunks)
+        for chunk in chunks:
+            self.length += len(chunk)
+
+    def take(self):
+        """ Returns the content written so far and empties the buffer. """
+        chunk = ''.join(self)
+        del self[:]
+        self.length = 0
+        return chunk
+
+
+class LRUCache(object):
+    """
+    A thread-safe dict-like cache holding at most `maxsize` items,
+    the least recently used item is dropped first.
+
+    With `maxbytes` it also holds at most that many bytes, the size 
+    of a value is `sizeof(value)`, len() by default.
+
+    Usage:
+        cache = LRUCache(100)
+        cache['key'] = value
+        cache.get('key')        # value, counted as a hit
+        cache.get('other')      # None, counted as a miss
+        pages = LRUCache(1000, maxbytes=16 * 1024 * 1024)
+    """
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=len):
+        self.maxsize, self.maxbytes = maxsize, maxbytes
+        self.sizeof = sizeof
+        self.hits = self.misses = self.evictions = 0
+        self.bytes = 0
+        # key -> link [prev, next, key, value, size] of a circular 
+        # list, root.next is the oldest item
+        self._data = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, 0]
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            # move to the newest end
+            prev, next = link[0], link[1]
+            prev[1], next[0] = next, prev
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = link
+            link[0], link[1] = last, root
+            self.hits += 1
+            return link[3]
+
+    def __setitem__(self, key, value):
+        maxbytes = self.maxbytes
+        size = self.sizeof(value) if maxbytes is not None else 0
+        with self._lock:
+            self._unlink(key)
+            root = self._root
+            last = root[0]
+            last[1] = root[0] = self._data[key] = \
+                [last, root, key, value, size]
+            self.bytes += size
+            while len(self._data) > self.maxsize or \
+                    (maxbytes is not None and self.bytes > maxbytes):
+                self._unlink(root[1][2])
+                self.evictions += 1
+
+    def _unlink(self, key):
+        link = self._data.pop(key, None)
+        if link is not None:
+            prev, next = link[0], link[1]
+            prev[1], next[0] = next, prev
+            self.bytes -= link[4]
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._data:
+                raise KeyError(key)
+            self._unlink(key)
+
+    def pop(self, key, default=None):
+        """ Removes a key and returns its value, no hit or miss. """
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                return default
+            self._unlink(key)
+            return link[3]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        """ Returns a list of the keys, oldest first. """
+        with self._lock:
+            keys, link = [], self._root[1]
+            while link is not self._root:
+                keys.append(link[2])
+                link = link[1]
+            return keys
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._root[:] = [self._root, self._root, None, None, 0]
+            self.bytes = 0
+
+    def info(self):
+        """ Returns the cache statistics as a Storage. """
+        return Storage(hits=self.hits, misses=self.misses, 
+            evictions=self.evictions, size=len(self._data), 
+            maxsize=self.maxsize, bytes=self.bytes, maxbytes=self.maxbytes)
+
+    def __repr__(self):
+        return '<LRUCache %d/%d>' % (len(self._data), self.maxsize)
 
 
 class Storage(dict):
@@ -130,4 +275,69 @@ class ThreadDict(threadlocal):
         return '<ThreadedDict %r>' % self.__dict__
 
     __str__ = __repr__
-    
+
+
+class ContextVar(object):
+    """
+    A context variable, every thread (or greenlet, if greenlet is 
+    installed) sees the value it set itself.
+
+    Usage:
+        current_user = ContextVar('current_user')
+        current_user.set(user)
+        current_user.get()      # user, in this context only
+        current_user.reset()    # forget it when done
+    """
+    __slots__ = ('name', '_values')
+
+    def __init__(self, name):
+        self.name = name
+        self._values = {}
+
+    def get(self, *default):
+        try:
+            return self._values[get_ident()]
+        except KeyError:
+            if default:
+                return default[0]
+            raise LookupError(self.name)
+
+    def set(self, value):
+        self._values[get_ident()] = value
+
+    def reset(self):
+        self._values.pop(get_ident(), None)
+
+    def __repr__(self):
+        return '<ContextVar %s>' % self.name
+
+
+class ContextProxy(object):
+    """
+    Forwards attribute access to the current value of a ContextVar.
+    """
+    __slots__ = ('_var',)
+
+    def __init__(self, var):
+        object.__setattr__(self, '_var', var)
+
+    def _get_current(self):
+        try:
+            return self._var._values[get_ident()]
+        except KeyError:
+            raise AttributeError("%s is not bound in this context" % self._var.name)
+
+    def __getattr__(self, name):
+        try:
+            return getattr(self._var._values[get_ident()], name)
+        except KeyError:
+            raise AttributeError("%s is not bound in this context" % self._var.name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get_current(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._get_current(), name)
+
+    def __repr__(self):
+        return '<ContextProxy %r>' % self._var.get(None)
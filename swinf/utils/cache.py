@@ -0,0 +1,232 @@
+# Caches of whole responses: policies, backends and single-flight calls
+
+__all__ = [
+    "cached", "CachePolicy",
+    "MemoryCache", "DiskCache", "SingleFlight",
+]
+
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+import functools
+import cPickle as pickle
+from threading import Lock, Event
+from swinf.utils import LRUCache, Storage
+
+
+class CachePolicy(object):
+    """ How the responses of a handler are cached: for `ttl` seconds,
+    one copy per method, path and the values of the `vary` names.
+
+    A name in `vary` is a query parameter, or a cookie if it is
+    prefixed by 'cookie:'. `backend` is a cache object, the page
+    cache of swinf is used if it is None. """
+    __slots__ = ('ttl', 'vary', 'backend')
+
+    def __init__(self, ttl=60, vary=(), backend=None):
+        if isinstance(vary, basestring):
+            vary = (vary,)
+        self.ttl, self.vary, self.backend = ttl, tuple(vary), backend
+
+    def key(self, request):
+        """ Returns the cache key of a request. """
+        parts = [request.method, request.path]
+        for name in self.vary:
+            if name.startswith('cookie:'):
+                parts.append(request.COOKIES.get(name[7:]))
+            else:
+                parts.append(request.GET.get(name))
+        return repr(tuple(parts))
+
+    def __repr__(self):
+        return '<CachePolicy ttl=%r vary=%r>' % (self.ttl, self.vary)
+
+
+def cached(ttl=60, vary=(), backend=None):
+    """ Decorator to cache the whole response of a handler.
+
+    Hits are answered before the handler hooks run, only GET and HEAD
+    requests with a 200 status and no cookies set are stored.
+
+    Example:
+        @route('/news')
+        @cached(ttl=30, vary=['page', 'cookie:lang'])
+        def news():
+            return template('news', page=request.GET.get('page'))
+
+    Same as @route('/news', cache={'ttl': 30, 'vary': [...]}).
+    """
+    policy = CachePolicy(ttl, vary, backend)
+    def decorator(func):
+        try:
+            func.cache_policy = policy
+        except AttributeError:
+            # bound methods and builtins take no attributes
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                return func(*args, **kwargs)
+            wrapper.cache_policy = policy
+            return wrapper
+        return func
+    return decorator
+
+
+def sizeof(value):
+    """ Approximate bytes of a value of strings, tuples and lists. """
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum([sizeof(item) for item in value])
+    if isinstance(value, dict):
+        return sum([sizeof(k) + sizeof(v) for k, v in value.iteritems()])
+    return 8
+
+
+class MemoryCache(object):
+    """
+    An in-process cache with expiring items, at most `max_entries`
+    items and `max_bytes` bytes, least recently used first out.
+
+    Usage:
+        cache = MemoryCache(max_bytes=8 * 1024 * 1024)
+        cache.set('key', value, ttl=60)
+        cache.get('key')        # value, or None if missing or expired
+    """
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024, \
+            sizeof=sizeof):
+        # key -> (expires, value)
+        self.cache = LRUCache(max_entries, max_bytes, \
+                lambda item: sizeof(item[1]))
+        self.expired = 0
+
+    def get(self, key):
+        item = self.cache.get(key)
+        if item is None:
+            return None
+        if item[0] is not None and item[0] < time.time():
+            self.cache.pop(key)
+            self.expired += 1
+            return None
+        return item[1]
+
+    def set(self, key, value, ttl=None):
+        self.cache[key] = (time.time() + ttl if ttl else None, value)
+
+    def delete(self, key):
+        self.cache.pop(key)
+
+    def keys(self):
+        return self.cache.keys()
+
+    def clear(self):
+        self.cache.clear()
+
+    def info(self):
+        info = self.cache.info()
+        info.expired = self.expired
+        return info
+
+
+class DiskCache(object):
+    """
+    A cache of pickled items in files under `path`, shared by the
+    processes of a server. Files are replaced atomically.
+
+    Usage:
+        cache = DiskCache('./cache/pages')
+        cache.set('key', value, ttl=60)
+        cache.get('key')
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.hits = self.misses = 0
+
+    def _filename(self, key):
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.path, digest[:2], digest)
+
+    def get(self, key):
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                expires, stored_key, value = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        if stored_key != key:
+            self.misses += 1
+            return None
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        filename = self._filename(key)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # made by another process meanwhile
+                pass
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time() + ttl if ttl else None, key, value), \
+                        f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, filename)
+        except:
+            os.remove(tmp)
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def info(self):
+        return Storage(hits=self.hits, misses=self.misses, path=self.path)
+
+
+class SingleFlight(object):
+    """
+    Runs a function once for concurrent calls with the same key, the
+    other callers wait for it and share its result.
+
+    Usage:
+        flights = SingleFlight()
+        result, shared = flights.do(key, render)
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """ Returns (result, shared), `shared` is True for callers
+        that waited for another one. Those get (None, True) if the
+        function raised, the exception goes to its own caller only. """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [Event(), None]
+        if not leader:
+            call[0].wait()
+            return call[1], True
+        try:
+            call[1] = func()
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1], False
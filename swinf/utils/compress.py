@@ -0,0 +1,78 @@
+# gzip / deflate encoding of response bodies
+
+__all__ = [
+    "accept_encoding", "CompressedBody",
+]
+
+import zlib
+
+# encodings in order of preference, with zlib wbits
+ENCODINGS = (
+    ('gzip', 16 + zlib.MAX_WBITS),
+    ('deflate', zlib.MAX_WBITS),
+)
+
+
+def accept_encoding(header):
+    """ Returns the preferred encoding a client accepts by its
+    Accept-Encoding header ('gzip', 'deflate'), or None.
+
+    Example:
+        accept_encoding('deflate, gzip;q=0.5')  # 'deflate'
+        accept_encoding('gzip;q=0, *')          # 'deflate'
+    """
+    if not header:
+        return None
+    qualities = {}
+    for item in header.split(','):
+        params = item.strip().split(';')
+        coding = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    best, best_q = None, 0.0
+    for coding, wbits in ENCODINGS:
+        q = qualities.get(coding, qualities.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compressor(encoding, level=6):
+    return zlib.compressobj(level, zlib.DEFLATED, dict(ENCODINGS)[encoding])
+
+
+def compress(chunks, encoding, level=6):
+    """ Compresses a list of byte strings into one. """
+    c = compressor(encoding, level)
+    return ''.join([c.compress(chunk) for chunk in chunks]) + c.flush()
+
+
+class CompressedBody(object):
+    """ Compresses a WSGI iterable as it is iterated.
+
+    Every chunk is flushed, so a streamed response still reaches the
+    client piece by piece, and close() is passed on to the wrapped
+    iterable. """
+    def __init__(self, output, encoding, level=6):
+        self.output = output
+        self.encoding, self.level = encoding, level
+
+    def __iter__(self):
+        c = compressor(self.encoding, self.level)
+        for chunk in self.output:
+            if chunk:
+                data = c.compress(chunk) + c.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+        yield c.flush()
+
+    def close(self):
+        if hasattr(self.output, 'close'):
+            self.output.close()
@@ -0,0 +1,223 @@
+# Incremental parser of request bodies
+# reads wsgi.input in fixed-size chunks and never more than CONTENT_LENGTH
+
+__all__ = [
+    "FileUpload", "parse_form_data",
+]
+
+import cgi
+import tempfile
+from urlparse import parse_qsl
+from swinf.core.exceptions import HTTPError
+
+
+class FileUpload(object):
+    """ A file part of a multipart body.
+
+    The content is kept in memory up to the spool threshold and in a
+    temporary file beyond, `file` is positioned at the start. """
+    def __init__(self, fp, name, filename, content_type, headers):
+        self.file = fp
+        self.name = name
+        self.filename = filename
+        self.content_type = self.type = content_type
+        self.headers = headers
+
+    @property
+    def value(self):
+        """ The whole content as a string. """
+        self.file.seek(0)
+        try:
+            return self.file.read()
+        finally:
+            self.file.seek(0)
+
+    def save(self, path, chunk_size=64 * 1024):
+        """ Copies the content to `path`. """
+        self.file.seek(0)
+        with open(path, 'wb') as f:
+            chunk = self.file.read(chunk_size)
+            while chunk:
+                f.write(chunk)
+                chunk = self.file.read(chunk_size)
+        self.file.seek(0)
+
+    def __repr__(self):
+        return '<FileUpload %s: %r>' % (self.name, self.filename)
+
+
+def too_large(what):
+    return HTTPError(413, "Request entity too large: %s" % what)
+
+
+def read_chunks(stream, length, chunk_size):
+    """ Yields at most `length` bytes of `stream` in chunks. """
+    while length > 0:
+        chunk = stream.read(min(chunk_size, length))
+        if not chunk:
+            break
+        length -= len(chunk)
+        yield chunk
+
+
+def parse_form_data(environ, max_body_size=10 * 1024 * 1024, \
+        max_field_size=1024 * 1024, max_fields=1000, \
+        spool_threshold=512 * 1024, chunk_size=64 * 1024):
+    """ Parses an urlencoded or multipart request body.
+
+    Returns a list of (name, value) pairs, value is a string or a
+    FileUpload. Raises HTTPError(413) if the body, a non-file field
+    or the number of fields exceeds its limit. """
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        return []
+    if max_body_size is not None and length > max_body_size:
+        raise too_large("body is longer than %d bytes" % max_body_size)
+    content_type, options = cgi.parse_header(environ.get('CONTENT_TYPE', ''))
+    chunks = read_chunks(environ['wsgi.input'], length, chunk_size)
+    if content_type == 'multipart/form-data':
+        boundary = options.get('boundary')
+        if not boundary:
+            raise HTTPError(400, "Multipart boundary missing")
+        parser = MultipartParser(boundary, max_field_size, max_fields, \
+                spool_threshold)
+        return parser.parse(chunks)
+    if content_type in ('application/x-www-form-urlencoded', ''):
+        return parse_urlencoded(chunks, max_field_size, max_fields)
+    return []
+
+
+def parse_urlencoded(chunks, max_field_size, max_fields):
+    """ Splits an urlencoded body on '&' while it is read. """
+    fields, rest = [], ''
+
+    def too_long(field):
+        return max_field_size is not None and len(field) > max_field_size
+
+    def add(pair):
+        if not pair:
+            return
+        if too_long(pair):
+            raise too_large("field is longer than %d bytes" % max_field_size)
+        if max_fields is not None and len(fields) >= max_fields:
+            raise too_large("more than %d fields" % max_fields)
+        fields.extend(parse_qsl(pair, keep_blank_values=True))
+
+    for chunk in chunks:
+        pairs = (rest + chunk).split('&')
+        rest = pairs.pop()
+        for pair in pairs:
+            add(pair)
+        # a field not finished yet, checked before more is read
+        if too_long(rest):
+            raise too_large("field is longer than %d bytes" % max_field_size)
+    add(rest)
+    return fields
+
+
+class MultipartParser(object):
+    """ Parses a multipart/form-data body chunk by chunk.
+
+    Only the current chunk and a delimiter-sized tail are held in
+    memory, file parts go to SpooledTemporaryFile objects. """
+    max_header_size = 16 * 1024
+
+    def __init__(self, boundary, max_field_size=None, max_fields=None, \
+            spool_threshold=512 * 1024):
+        self.delimiter = '\r\n--' + boundary
+        self.max_field_size = max_field_size
+        self.max_fields = max_fields
+        self.spool_threshold = spool_threshold
+
+    def parse(self, chunks):
+        delimiter = self.delimiter
+        # the first delimiter has no leading CRLF
+        buf, state, fields = '\r\n', 'preamble', []
+        part = None
+        for chunk in chunks:
+            buf += chunk
+            while True:
+                if state == 'preamble' or state == 'body':
+                    index = buf.find(delimiter)
+                    if index < 0:
+                        # keep what may be the start of a delimiter
+                        keep = len(delimiter) - 1
+                        if part is not None and len(buf) > keep:
+                            part.write(buf[:-keep])
+                        buf = buf[-keep:]
+                        break
+                    if part is not None:
+                        part.write(buf[:index])
+                        fields.append(part.finish())
+                        part = None
+                    buf = buf[index + len(delimiter):]
+                    state = 'delimiter'
+                elif state == 'delimiter':
+                    if len(buf) < 2:
+                        break
+                    if buf.startswith('--'):
+                        return fields
+                    if not buf.startswith('\r\n'):
+                        raise HTTPError(400, "Malformed multipart body")
+                    buf = buf[2:]
+                    state = 'headers'
+                elif state == 'headers':
+                    index = buf.find('\r\n\r\n')
+                    if index < 0:
+                        if len(buf) > self.max_header_size:
+                            raise too_large("part headers")
+                        break
+                    if self.max_fields is not None and \
+                            len(fields) >= self.max_fields:
+                        raise too_large("more than %d fields" % self.max_fields)
+                    part = self.new_part(buf[:index])
+                    buf = buf[index + 4:]
+                    state = 'body'
+        # body ended before the closing delimiter
+        return fields
+
+    def new_part(self, head):
+        headers = {}
+        for line in head.split('\r\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().title()] = value.strip()
+        disposition, options = cgi.parse_header(headers.get('Content-Disposition', ''))
+        name = options.get('name', '')
+        content_type = headers.get('Content-Type', 'text/plain')
+        if options.get('filename'):
+            return FilePart(name, options['filename'], content_type, \
+                    headers, self.spool_threshold)
+        return FieldPart(name, self.max_field_size)
+
+
+class FieldPart(object):
+    def __init__(self, name, max_size):
+        self.name, self.max_size = name, max_size
+        self.data, self.size = [], 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise too_large("field %s is longer than %d bytes" % \
+                    (self.name, self.max_size))
+        self.data.append(data)
+
+    def finish(self):
+        return (self.name, ''.join(self.data))
+
+
+class FilePart(object):
+    def __init__(self, name, filename, content_type, headers, threshold):
+        self.upload = FileUpload(tempfile.SpooledTemporaryFile(threshold), \
+                name, filename, content_type, headers)
+
+    def write(self, data):
+        self.upload.file.write(data)
+
+    def finish(self):
+        self.upload.file.seek(0)
+        return (self.upload.name, self.upload)
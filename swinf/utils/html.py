@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import time
+from email.utils import parsedate_tz, mktime_tz
+
 HTTP_CODES = {
     100: 'CONTINUE',
     101: 'SWITCHING PROTOCOLS',
@@ -43,8 +46,151 @@ HTTP_CODES = {
     505: 'HTTP VERSION NOT SUPPORTED',
 }
 
-def html_escape(c):
-    ''' Escape HTML special characters `&<>` and quotes `'"`'''
-    c = str(c)
-    return c.replace('&','&amp;').replace('<','&lt;').replace('>','&gt;')\
-                 .replace('"','&quot;').replace("'",'&#039;')
+class Markup(unicode):
+    """
+    A unicode string of html, html_escape passes it on untouched.
+    SimpleTemplate.render returns its output as Markup.
+
+    usage:
+        Markup(u'<b>bold</b>')      # trusted html
+        Markup.escape(u'a < b')     # escaped once, u'a &lt; b'
+    """
+    __slots__ = ()
+
+    def __html__(self):
+        return self
+
+    @classmethod
+    def escape(cls, s):
+        return cls(html_escape(s))
+
+    def __repr__(self):
+        return 'Markup(%s)' % unicode.__repr__(self)
+
+
+# types whose str() has nothing to escape
+_NUMBERS = frozenset([int, long, float, bool])
+
+def html_escape(c, encoding='utf8'):
+    ''' Escape HTML special characters `&<>` and quotes `'"`.
+
+    Markup and objects with an __html__ method are passed on, numbers
+    are converted without a scan, byte strings are decoded with
+    `encoding`. '''
+    cls = type(c)
+    if cls is not unicode:
+        if cls is Markup:
+            return c
+        if cls in _NUMBERS:
+            return str(c)
+        if cls is str:
+            c = c.decode(encoding)
+        elif hasattr(c, '__html__'):
+            return c.__html__()
+        else:
+            c = unicode(c)
+    if len(c) < 128:
+        # most values have nothing to escape and are returned as they are
+        if not (u'&' in c or u'<' in c or u'>' in c or u'"' in c or \
+                u"'" in c):
+            return c
+        return c.replace(u'&', u'&amp;').replace(u'<', u'&lt;')\
+                .replace(u'>', u'&gt;').replace(u'"', u'&quot;')\
+                .replace(u"'", u'&#039;')
+    # replace() of a byte string is about twice as fast on long text
+    try:
+        c = c.encode('ascii')
+    except UnicodeEncodeError:
+        return c.replace(u'&', u'&amp;').replace(u'<', u'&lt;')\
+                .replace(u'>', u'&gt;').replace(u'"', u'&quot;')\
+                .replace(u"'", u'&#039;')
+    return c.replace('&', '&amp;').replace('<', '&lt;')\
+            .replace('>', '&gt;').replace('"', '&quot;')\
+            .replace("'", '&#039;')
+
+
+def http_date(value):
+    ''' Formats a timestamp, datetime or time tuple as an HTTP date.'''
+    if isinstance(value, basestring):
+        return value
+    if hasattr(value, 'utctimetuple'):
+        value = value.utctimetuple()
+    elif isinstance(value, (int, long, float)):
+        value = time.gmtime(value)
+    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", value)
+
+
+def parse_date(value):
+    ''' Parses an HTTP date to a timestamp, None if it is invalid.'''
+    try:
+        return mktime_tz(parsedate_tz(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def make_etag(value, weak=False):
+    ''' Quotes a value as an entity tag, W/"value" if weak.'''
+    value = str(value)
+    if not (value.startswith('"') or value.startswith('W/"')):
+        value = '"%s"' % value
+    if weak and not value.startswith('W/'):
+        value = 'W/' + value
+    return value
+
+
+def etag_matches(etag, if_none_match):
+    ''' Weak comparison of an entity tag with an If-None-Match header.'''
+    if if_none_match.strip() == '*':
+        return True
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def parse_range_header(header, size):
+    ''' Parses a Range header against a resource of `size` bytes.
+
+    Returns a list of (start, end) byte offsets, end exclusive, an
+    empty list if no range is satisfiable, or None if the header is
+    invalid and should be ignored.
+
+    Example:
+        parse_range_header('bytes=0-99,-100', 1000)  # [(0, 100), (900, 1000)]
+    '''
+    if not header or '=' not in header:
+        return None
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        start, sep, end = spec.partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                # suffix range, the last `end` bytes
+                length = int(end)
+                if length < 0:
+                    return None
+                if length:
+                    ranges.append((max(size - length, 0), size))
+                continue
+            start = int(start)
+            end = int(end) + 1 if end else max(size, start + 1)
+        except ValueError:
+            return None
+        if start < 0 or end <= start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size)))
+    return ranges
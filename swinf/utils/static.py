@@ -0,0 +1,151 @@
+# Resolving and caching of the files sent by swinf.send_file
+
+__all__ = [
+    "StaticFile", "StaticFiles", "load_static_file",
+]
+
+import os
+import stat
+import time
+import mimetypes
+from swinf.core.exceptions import HTTPError
+from swinf.utils import LRUCache, Storage
+from swinf.utils.html import http_date, make_etag
+
+
+class StaticFile(object):
+    """ A resolved file with its stat result and the response headers
+    to send it with. `body` is its content if it is held in memory. """
+    __slots__ = ('path', 'size', 'mtime', 'checked', 'content_type', \
+            'headers', 'body')
+
+    def __init__(self, path, stats, content_type, body=None, checked=0):
+        self.path, self.content_type, self.body = path, content_type, body
+        self.size, self.mtime = stats.st_size, stats.st_mtime
+        self.checked = checked
+        self.headers = (
+            ('Content-Length', str(self.size)),
+            ('Last-Modified', http_date(self.mtime)),
+            ('ETag', make_etag('%x-%x' % (self.size, int(self.mtime)), \
+                    weak=True)),
+            ('Accept-Ranges', 'bytes'),
+        )
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def __repr__(self):
+        return '<StaticFile %s%s>' % (self.path, \
+                ' (in memory)' if self.body is not None else '')
+
+
+def load_static_file(filename, root="", guessmime=True, \
+        mimetype='text/plain', max_file_size=0):
+    """ Resolves `filename` under `root` to a StaticFile, raises
+    HTTPError 401 for paths outside of root or unreadable files and
+    404 for missing ones. Files up to `max_file_size` bytes are read
+    into memory. """
+    root = os.path.realpath(root)
+    # resolves '..' and symlinks before the check
+    path = os.path.realpath(os.path.join(root, filename.lstrip('/')))
+    if not path.startswith(root + os.sep):
+        raise HTTPError(401, "Access denied.")
+    try:
+        stats = os.stat(path)
+    except OSError:
+        stats = None
+    if stats is None or not stat.S_ISREG(stats.st_mode):
+        raise HTTPError(404, "File does not exists")
+    if not os.access(path, os.R_OK):
+        raise HTTPError(401, "You do not have permission to access this file.")
+
+    content_type = mimetype
+    if guessmime:
+        content_type = mimetypes.guess_type(path)[0] or mimetype
+
+    body = None
+    if stats.st_size <= max_file_size:
+        with open(path, 'rb') as f:
+            # stat the opened file, so body and headers agree
+            stats = os.fstat(f.fileno())
+            if stats.st_size <= max_file_size:
+                body = f.read()
+    return StaticFile(path, stats, content_type, body, time.time())
+
+
+def _sizeof(entry):
+    return len(entry.body) if entry.body is not None else 0
+
+
+class StaticFiles(object):
+    """
+    A cache of resolved files for send_file.
+
+    Paths and stat results are reused for `revalidate` seconds before
+    the file is checked on disk again, a changed file is loaded anew.
+    Files up to `max_file_size` bytes keep their content in memory,
+    at most `max_bytes` in total, least recently used first out.
+
+    Usage:
+        files = StaticFiles(max_bytes=8 * 1024 * 1024)
+        entry = files.lookup('app.js', root='./view/static/script')
+        files.info()        # hit rate and memory use
+    """
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, \
+            max_file_size=256 * 1024, revalidate=1.0):
+        self.files = LRUCache(max_entries, max_bytes, _sizeof)
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.revalidate = revalidate
+        self.revalidations = self.reloads = self.memory_hits = 0
+
+    def lookup(self, filename, root="", guessmime=True, mimetype='text/plain'):
+        key = (root, filename, guessmime, mimetype)
+        entry = self.files.get(key)
+        now = time.time()
+        if entry is not None:
+            if now - entry.checked >= self.revalidate:
+                entry = self._revalidate(key, entry, now)
+            if entry is not None:
+                if entry.body is not None:
+                    self.memory_hits += 1
+                return entry
+        entry = load_static_file(filename, root, guessmime, mimetype, \
+                self.max_file_size)
+        self.files[key] = entry
+        return entry
+
+    def _revalidate(self, key, entry, now):
+        """ Returns the entry if the file is unchanged, else drops it. """
+        self.revalidations += 1
+        try:
+            stats = os.stat(entry.path)
+        except OSError:
+            stats = None
+        if stats is not None and stats.st_size == entry.size and \
+                stats.st_mtime == entry.mtime:
+            entry.checked = now
+            return entry
+        self.reloads += 1
+        self.files.pop(key)
+        return None
+
+    def clear(self):
+        self.files.clear()
+
+    def info(self):
+        """ Returns the cache statistics as a Storage: hits and misses
+        of resolved files, hit_rate, memory_hits of files sent from
+        memory, revalidations, reloads of changed files and the
+        entries and bytes in use. """
+        info = self.files.info()
+        lookups = info.hits + info.misses
+        return Storage(hits=info.hits, misses=info.misses,
+            hit_rate=float(info.hits) / lookups if lookups else 0.0,
+            memory_hits=self.memory_hits, revalidations=self.revalidations,
+            reloads=self.reloads, evictions=info.evictions,
+            files=info.size, max_entries=info.maxsize,
+            bytes=info.bytes, max_bytes=info.maxbytes)
+
+    def __repr__(self):
+        return '<StaticFiles %d files, %d bytes>' % \
+                (len(self.files), self.files.bytes)